@@ -0,0 +1,127 @@
+'''
+Measures the memory and access cost of the models kept in large numbers
+
+Every model is compared with the previous implementation, reproduced here: events mirrored
+as dicts, Event attributes looked up in __annotations__ by __getattr__ and Assignment as a
+dataclass hashing its unique ID on construction.
+Run from the repository root: python benchmarks/bench_models.py [count]
+'''
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from hashlib import sha256
+from json import loads, dumps
+from pathlib import Path
+from timeit import timeit
+import tracemalloc
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.google_calendar import Event, EventRecord
+from src.mastercom import Assignment, AssignmentType
+
+
+COUNT = 100000
+ACCESSES = 1000000
+
+
+@dataclass
+class DataclassAssignment:
+    start: datetime
+    kind: AssignmentType
+    unique_id: str = None
+    subject_id: int = None
+    end: datetime = None
+    title: str = None
+    description: str = None
+    source_id: str = None
+    recurrence: list = None
+    subject_name: str = None
+
+    def __post_init__(self) -> None:
+        if self.unique_id is None:
+            seed = ':'.join(str(i) for i in [self.kind.name, self.start.isoformat(), self.subject_id, self.title, self.description])
+            self.unique_id = sha256(seed.encode('utf8')).hexdigest()
+
+
+class AnnotationsEvent:
+    '''Event as it was, every field is looked up in __annotations__ by __getattr__'''
+    __annotations__ = Event.__annotations__
+
+    def __init__(self, calendar, source_dict: dict) -> None:
+        self._calendar = calendar
+        self._dict = source_dict
+
+    def __getattr__(self, name: str):
+        if name in self.__annotations__.keys():
+            return self._dict.get(name)
+        raise AttributeError(name)
+
+
+class FakeCalendar:
+    _service = None
+    id = 'calendar'
+
+
+def event_json(i: int) -> str:
+    '''An event as events.list returns it with fields=COMPARED_FIELDS'''
+    return dumps({
+        'id': f'{i:026x}', 'etag': f'"{3000000000000000 + i}"', 'status': 'confirmed',
+        'summary': f'Matematica: esercizi {i} pag. {i % 300}', 'description': f'Esercizi {i} pag. {i % 300}',
+        'start': {'dateTime': '2026-10-19T08:00:00+02:00', 'timeZone': 'Europe/Rome'},
+        'end': {'dateTime': '2026-10-19T09:00:00+02:00', 'timeZone': 'Europe/Rome'},
+        'colorId': '4', 'extendedProperties': {'private': {'autocalendarHash': sha256(str(i).encode()).hexdigest()[:16]}}})
+
+
+def retained(build) -> tuple:
+    '''Returns what build() returns and the memory it still holds'''
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_mirror(count: int):
+    documents = [event_json(i) for i in range(count)]
+    dicts, dicts_size = retained(lambda: [loads(i) for i in documents])
+    _, records_size = retained(lambda: [EventRecord(loads(i)) for i in documents])
+
+    print(f'Mirrored event    dict {dicts_size / count:8.0f} B   EventRecord {records_size / count:8.0f} B')
+    del dicts
+
+
+def bench_event_access(accesses: int):
+    event_dict = loads(event_json(0))
+    event = Event(FakeCalendar(), event_dict)
+    old_event = AnnotationsEvent(FakeCalendar(), event_dict)
+    assert event.summary == old_event.summary
+
+    new_time = timeit(lambda: event.summary, number=accesses)
+    old_time = timeit(lambda: old_event.summary, number=accesses)
+    print(f'Event.summary     __getattr__ {old_time / accesses * 1e9:6.0f} ns   descriptor {new_time / accesses * 1e9:6.0f} ns')
+
+
+def bench_assignments(count: int):
+    start = datetime(2026, 9, 14, 8)
+    arguments = [dict(start=start + timedelta(hours=i), kind=AssignmentType.TIMETABLE, subject_id=1000117 + i % 7,
+        end=start + timedelta(hours=i + 1)) for i in range(count)]
+
+    old, old_size = retained(lambda: [DataclassAssignment(**i) for i in arguments])
+    new, new_size = retained(lambda: [Assignment(**i) for i in arguments])
+    assert old[0].unique_id == new[0].unique_id
+    del old, new
+
+    old_time = timeit(lambda: [DataclassAssignment(**i) for i in arguments], number=1)
+    new_time = timeit(lambda: [Assignment(**i) for i in arguments], number=1)
+
+    print(f'Lesson            dataclass {old_size / count:6.0f} B {old_time / count * 1e9:6.0f} ns'
+        f'   slots (ID not read) {new_size / count:6.0f} B {new_time / count * 1e9:6.0f} ns')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+
+    bench_mirror(count)
+    bench_event_access(ACCESSES)
+    bench_assignments(count)
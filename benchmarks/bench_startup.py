@@ -0,0 +1,45 @@
+'''
+Measures the cold start of a scheduled run
+
+Every measurement runs in a fresh interpreter, so that nothing is already imported.
+Run from the repository root: python benchmarks/bench_startup.py
+'''
+from pathlib import Path
+from subprocess import run
+from statistics import median
+import sys
+
+
+ROOT = Path(__file__).parent.parent
+REPEATS = 5
+
+STAGES = {
+    # Stage name: code timed in a fresh interpreter
+    'import mastercom': 'from src.mastercom import MastercomAPI',
+    'import calendar_adder': 'from src.calendar_adder import CalendarAdder',
+    'build calendar service': '''
+from google.auth.credentials import AnonymousCredentials
+from src.google_api import GoogleAPI
+GoogleAPI(AnonymousCredentials()).build('calendar', 'v3')''',
+}
+
+TIMER = '''
+from time import perf_counter
+start = perf_counter()
+{}
+print(perf_counter() - start)
+'''
+
+
+def time_stage(code: str) -> float:
+    result = run([sys.executable, '-c', TIMER.format(code)], cwd=ROOT, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return float(result.stdout)
+
+
+if __name__ == '__main__':
+    for name, code in STAGES.items():
+        times = [time_stage(code) for _ in range(REPEATS)]
+        print(f'{name:<25} median {median(times) * 1000:8.1f} ms   max {max(times) * 1000:8.1f} ms')
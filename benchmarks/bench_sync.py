@@ -0,0 +1,120 @@
+'''
+Measures a sync against local stand-ins of Mastercom and Google Calendar
+
+For every calendar size it runs a first sync, a sync with nothing to change and one after
+some assignments changed or disappeared, and reports the wall time, the requests made to
+each service, the bytes transferred and the peak memory of the sync.
+The times are measured in a first pass and the memory in a second one, as tracing slows down
+the program. The servers run in their own processes, so they are not measured.
+Run from the repository root: python benchmarks/bench_sync.py [sizes...] [--latency ms]
+'''
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fake_server import FakeServerProcess
+from fake_mastercom import FakeMastercom, base_url, USERNAME, PASSWORD
+from fake_calendar import FakeCalendar, calendar_service
+
+from src import mastercom
+from src.calendar_adder import CalendarAdder
+from src.event_mirror import EventMirror
+from src.event_store import SQLiteEventStore
+from src.google_calendar import Calendar
+from src.http_client import CachedHTTPClient
+from src.mastercom import MastercomAPI
+from src.rate_limit import TokenBucket
+from src.subjects import SubjectCache
+
+
+SIZES = [100, 1000, 10000]
+TEST_SHARE = 0.2 # The rest of the events are homework
+BATCH_SIZE = 50
+
+SCENARIOS = {
+    # Scenario name: edit of the homework feed before the sync
+    'first sync': None,
+    'unchanged': None,
+    'changed': {'changed': 0.1, 'removed': 0.05},
+}
+
+
+def run_pass(calendar_server: FakeServerProcess, mastercom_server: FakeServerProcess, size: int, trace_memory: bool) -> dict:
+    '''Runs every scenario on a new calendar, returns {scenario: measurements}'''
+    calendar_id = f'bench-{size}-{"memory" if trace_memory else "time"}'
+    calendar_server.control('create', id=calendar_id)
+    mastercom_server.control('generate', homework=size - int(size * TEST_SHARE), tests=int(size * TEST_SHARE))
+
+    results = {}
+
+    with TemporaryDirectory() as temp_dir:
+        mastercom_api = MastercomAPI.from_user_pass(USERNAME, PASSWORD, 'bench', 'bench', 'bench',
+            client=CachedHTTPClient(Path(temp_dir) / 'http', ttl=0),
+            subject_cache=SubjectCache(Path(temp_dir) / 'subjects.json'))
+        calendar = Calendar.from_id(calendar_service(calendar_server.url), calendar_id, TokenBucket(10 ** 9))
+        calendar_adder = CalendarAdder(calendar, mastercom_api, BATCH_SIZE,
+            EventMirror(calendar, Path(temp_dir) / 'event_mirror.json'),
+            SQLiteEventStore(Path(temp_dir) / 'added_events.db', None))
+
+        for scenario, edit in SCENARIOS.items():
+            if edit is not None:
+                mastercom_server.control('edit', **edit)
+            calendar_server.reset()
+            mastercom_server.reset()
+            calendar_adder.reset_tally()
+
+            if trace_memory:
+                tracemalloc.start()
+            start = perf_counter()
+            calendar_adder.sync()
+            elapsed = perf_counter() - start
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            results[scenario] = {
+                'time': elapsed,
+                'peak_memory': peak if trace_memory else None,
+                'calendar': calendar_server.stats(),
+                'mastercom': mastercom_server.stats(),
+                'events': calendar_server.control('count', id=calendar_id)['events']}
+
+        calendar_adder.store.close()
+
+    return results
+
+
+def print_results(size: int, timed: dict, traced: dict):
+    for scenario, result in timed.items():
+        calendar_stats = result['calendar']
+        mastercom_stats = result['mastercom']
+        transferred = sum(i['bytes_received'] + i['bytes_sent'] for i in (calendar_stats, mastercom_stats))
+
+        print(f'{size:>6} {scenario:<11}'
+            f' {result["time"]:8.2f} s'
+            f' {calendar_stats["requests"]:6} Google requests ({calendar_stats["calls"]:6} calls)'
+            f' {mastercom_stats["requests"]:3} Mastercom requests'
+            f' {transferred / 1024:10.1f} KiB'
+            f' {traced[scenario]["peak_memory"] / 2 ** 20:8.1f} MiB peak'
+            f' {result["events"]:6} events')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--latency', type=float, default=0, help='Delay of every response, in milliseconds')
+    args = parser.parse_args()
+
+    with FakeServerProcess(FakeCalendar, 0, args.latency / 1000) as calendar_server, \
+            FakeServerProcess(FakeMastercom, 0, args.latency / 1000) as mastercom_server:
+        mastercom.BASE_URL = base_url(mastercom_server.url)
+
+        for size in args.sizes:
+            timed = run_pass(calendar_server, mastercom_server, size, trace_memory=False)
+            traced = run_pass(calendar_server, mastercom_server, size, trace_memory=True)
+            print_results(size, timed, traced)
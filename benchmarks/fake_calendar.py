@@ -0,0 +1,281 @@
+'''
+A local stand-in for the Google Calendar v3 API
+
+It answers calendars.get, the events methods (list with paging, sync tokens, time windows and
+fields projections; get, insert, patch, update and delete) and batch requests.
+Calendars are created through /_fake/create. calendar_service() builds a Resource that talks to it.
+'''
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from urllib.parse import urlsplit, parse_qsl, unquote
+from uuid import uuid4
+from json import loads
+from pathlib import Path
+import re
+import sys
+
+from fake_server import FakeServer, json_response
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.google_api import discovery_document
+
+
+MAX_PAGE_SIZE = 2500
+DEFAULT_PAGE_SIZE = 250
+
+
+def calendar_service(url: str):
+    '''Builds a Calendar service that sends every request to the server at url'''
+    from googleapiclient.discovery import build_from_document
+    from httplib2 import Http
+
+    document = dict(discovery_document('calendar', 'v3'), rootUrl=url + '/')
+    return build_from_document(document, http=Http())
+
+
+def error_response(status: int, reason: str, message: str) -> tuple:
+    return json_response(status, {'error': {
+        'code': status,
+        'message': message,
+        'errors': [{'domain': 'global', 'reason': reason, 'message': message}]}})
+
+
+def parse_fields(fields: str) -> dict:
+    '''Parses a fields projection, "a,b(c,d)" becomes {'a': {}, 'b': {'c': {}, 'd': {}}}'''
+    def parse(position: int) -> tuple:
+        selection = {}
+        name = ''
+
+        while position < len(fields):
+            character = fields[position]
+            position += 1
+
+            if character == '(':
+                selection[name.strip()], position = parse(position)
+                name = ''
+            elif character in ',)':
+                if name.strip():
+                    selection[name.strip()] = {}
+                name = ''
+                if character == ')':
+                    return selection, position
+            else:
+                name += character
+
+        if name.strip():
+            selection[name.strip()] = {}
+        return selection, position
+
+    return parse(0)[0]
+
+
+def project(value, selection: dict):
+    '''Keeps only the selected fields, an empty selection keeps everything'''
+    if not selection:
+        return value
+    if isinstance(value, list):
+        return [project(i, selection) for i in value]
+    if isinstance(value, dict):
+        return {k: project(value[k], sub_selection) for k, sub_selection in selection.items() if k in value}
+    return value
+
+
+def merge(target: dict, patch: dict):
+    '''Patch semantics: objects are merged, any other value is replaced'''
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc)
+
+
+def event_time(time: dict) -> datetime:
+    if 'dateTime' in time:
+        return parse_time(time['dateTime'])
+    return datetime.fromisoformat(time['date']).astimezone(timezone.utc)
+
+
+def now_rfc3339() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class FakeCalendar(FakeServer):
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        super().__init__(port, latency)
+        self.calendars = {} # Calendar ID: calendar resource
+        self.events = {} # Calendar ID: {event ID: event}, deleted events are kept as cancelled
+        self.sequences = {} # Event ID: sequence number of its last change
+        self.sequence = 0
+
+    def control_create(self, id: str, summary: str = None) -> dict:
+        '''Creates an empty calendar, replacing any with the same ID'''
+        self.calendars[id] = {'kind': 'calendar#calendar', 'etag': '"0"', 'id': id,
+            'summary': summary or id, 'timeZone': 'Europe/Rome'}
+        self.events[id] = {}
+        return self.calendars[id]
+
+    def control_count(self, id: str) -> dict:
+        '''Counts the events of a calendar that are not cancelled'''
+        return {'events': sum(1 for i in self.events[id].values() if i['status'] != 'cancelled')}
+
+    def control_reset(self) -> dict:
+        stats = super().control_reset()
+        stats['calls'] = 0 # API calls, counting every call in a batch
+        stats['batches'] = 0
+        return stats
+
+    def respond(self, method: str, path: str, query: dict, headers, body: bytes) -> tuple:
+        if method == 'POST' and path == '/batch/calendar/v3':
+            with self.lock:
+                self.stats['batches'] += 1
+            return self._batch(headers['Content-Type'], body)
+
+        with self.lock:
+            self.stats['calls'] += 1
+            return self._call(method, path, query, body)
+
+    def _call(self, method: str, path: str, query: dict, body: bytes) -> tuple:
+        if not path.startswith('/calendar/v3/calendars/'):
+            return error_response(404, 'notFound', 'Not Found')
+
+        parts = [unquote(i) for i in path[len('/calendar/v3/calendars/'):].split('/')]
+        calendar_id = parts[0]
+
+        if calendar_id not in self.calendars:
+            return error_response(404, 'notFound', 'Not Found')
+
+        if len(parts) == 1 and method == 'GET':
+            status, response = 200, self.calendars[calendar_id]
+        elif len(parts) == 2 and parts[1] == 'events' and method == 'GET':
+            status, response = self._list(calendar_id, query)
+        elif len(parts) == 2 and parts[1] == 'events' and method == 'POST':
+            status, response = self._insert(calendar_id, loads(body))
+        elif len(parts) == 3 and parts[1] == 'events':
+            status, response = self._event(method, calendar_id, parts[2], loads(body) if body else None)
+        else:
+            return error_response(404, 'notFound', 'Not Found')
+
+        if status >= 400:
+            return error_response(status, *response)
+        if response is None:
+            return 204, b'', {}
+        return json_response(status, project(response, parse_fields(query.get('fields', ''))))
+
+    def _list(self, calendar_id: str, query: dict) -> tuple:
+        page_size = min(int(query.get('maxResults', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset, snapshot = (int(i) for i in query.get('pageToken', f'0:{self.sequence}').split(':'))
+        events = self.events[calendar_id]
+
+        if 'syncToken' in query:
+            sync_token = query['syncToken']
+            if not sync_token.isdigit() or int(sync_token) > self.sequence:
+                return 410, ('fullSyncRequired', 'Sync token is no longer valid, a full sync is required.')
+            items = [i for i in events.values() if int(sync_token) < self.sequences[i['id']] <= snapshot]
+        else:
+            items = [i for i in events.values() if self._matches(i, query) and self.sequences[i['id']] <= snapshot]
+
+        items.sort(key=lambda i: self.sequences[i['id']])
+        response = {
+            'kind': 'calendar#events',
+            'summary': self.calendars[calendar_id]['summary'],
+            'timeZone': self.calendars[calendar_id]['timeZone'],
+            'items': items[offset:offset + page_size]}
+
+        if offset + page_size < len(items):
+            response['nextPageToken'] = f'{offset + page_size}:{snapshot}'
+        else:
+            response['nextSyncToken'] = str(snapshot)
+        return 200, response
+
+    def _matches(self, event: dict, query: dict) -> bool:
+        if event['status'] == 'cancelled':
+            return query.get('showDeleted') == 'true'
+        if 'timeMin' in query and event_time(event['end']) <= parse_time(query['timeMin']):
+            return False
+        if 'timeMax' in query and event_time(event['start']) >= parse_time(query['timeMax']):
+            return False
+        if 'updatedMin' in query and parse_time(event['updated']) < parse_time(query['updatedMin']):
+            return False
+        if 'privateExtendedProperty' in query:
+            key, value = query['privateExtendedProperty'].split('=', 1)
+            return event.get('extendedProperties', {}).get('private', {}).get(key) == value
+        return True
+
+    def _insert(self, calendar_id: str, body: dict) -> tuple:
+        event_id = body.get('id') or uuid4().hex
+
+        if event_id in self.events[calendar_id]:
+            return 409, ('duplicate', 'The requested identifier already exists.')
+
+        event = dict(body, kind='calendar#event', id=event_id, status='confirmed', created=now_rfc3339())
+        self.events[calendar_id][event_id] = event
+        self._touch(event)
+        return 200, event
+
+    def _event(self, method: str, calendar_id: str, event_id: str, body: 'dict | None') -> tuple:
+        event = self.events[calendar_id].get(event_id)
+
+        if event is None:
+            return 404, ('notFound', 'Not Found')
+        if method == 'GET':
+            return 200, event
+        if event['status'] == 'cancelled':
+            return 410, ('deleted', 'Resource has been deleted')
+
+        if method == 'DELETE':
+            event['status'] = 'cancelled'
+            self._touch(event)
+            return 204, None
+        elif method == 'PATCH':
+            merge(event, body)
+        elif method == 'PUT':
+            kept = {k: event[k] for k in ('kind', 'id', 'created')}
+            event.clear()
+            event.update(body, status='confirmed', **kept)
+        else:
+            return 404, ('notFound', 'Not Found')
+
+        self._touch(event)
+        return 200, event
+
+    def _touch(self, event: dict):
+        self.sequence += 1
+        self.sequences[event['id']] = self.sequence
+        event['etag'] = f'"{self.sequence}"'
+        event['updated'] = now_rfc3339()
+
+    def _batch(self, content_type: str, body: bytes) -> tuple:
+        '''Runs every request of a multipart/mixed batch and answers with a multipart/mixed response'''
+        message = BytesParser().parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode('utf8') + body)
+        boundary = 'batch_' + uuid4().hex
+        response_parts = []
+
+        for part in message.get_payload():
+            head, _, request_body = re.split(r'(\r?\n\r?\n)', part.get_payload(), 1)
+            method, url, _ = head.splitlines()[0].split(' ', 2)
+            url = urlsplit(url)
+
+            with self.lock:
+                self.stats['calls'] += 1
+                status, response_body, headers = self._call(method, url.path, dict(parse_qsl(url.query)), request_body.encode('utf8'))
+
+            content_id = part['Content-ID'].strip('<>')
+            response_parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}\r\n'
+                + ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+                + f'Content-Length: {len(response_body)}\r\n\r\n{response_body.decode("utf8")}\r\n')
+
+        response = (''.join(response_parts) + f'--{boundary}--\r\n').encode('utf8')
+        return 200, response, {'Content-Type': f'multipart/mixed; boundary={boundary}'}
+
+
+if __name__ == '__main__':
+    server = FakeCalendar(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    server.control_create('primary', 'Calendario di prova')
+    print(f'Fake Google Calendar on {server.url}')
+    server.serve_forever()
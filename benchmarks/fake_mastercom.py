@@ -0,0 +1,112 @@
+'''
+A local stand-in for the Mastercom API
+
+It answers utenti/login, the compiti_plain, agenda_plain and orario_plain feeds
+of any student, with assignments generated through /_fake/generate, and materie.
+Point src.mastercom at it with: mastercom.BASE_URL = base_url(server.url)
+'''
+from datetime import date, datetime, timedelta
+from hashlib import sha1
+from json import loads, dumps
+import sys
+
+from fake_server import FakeServer, json_response
+
+
+USERNAME = 'studente'
+PASSWORD = 'password'
+TOKEN = 'fake-jwt-token'
+
+SUBJECT_IDS = [1000114, 1000117, 1000118, 1000119, 1000121, 1000130, 1000132]
+SUBJECTS = [{'id_materia': str(i), 'descrizione': name, 'docenti': [{'nome': 'Docente', 'cognome': name.capitalize()}]}
+    for i, name in zip(SUBJECT_IDS, ['ITALIANO', 'MATEMATICA', 'FISICA', 'SCIENZE', 'FILOSOFIA', 'STORIA', 'INGLESE'])]
+LESSONS_PER_DAY = 5
+
+FEEDS = ('compiti_plain', 'agenda_plain', 'orario_plain')
+
+
+def base_url(url: str) -> str:
+    '''The replacement for src.mastercom.BASE_URL that points to the server at url'''
+    return url + '/{}/api/v{}'
+
+
+class FakeMastercom(FakeServer):
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        super().__init__(port, latency)
+        self.feeds = {feed: [] for feed in FEEDS}
+
+    def control_generate(self, homework: int = 0, tests: int = 0, timetable_days: int = 0, start: str = None) -> dict:
+        '''Replaces the feeds, with the assignments spread over the days from start (today by default)'''
+        start = date.fromisoformat(start) if start is not None else date.today()
+        days = max(1, (homework + tests) // 4)
+
+        self.feeds['compiti_plain'] = [{
+            'id': i + 1,
+            'data': f'{start + timedelta(days=i % days)} {8 + i // days % LESSONS_PER_DAY:02}:00:00',
+            'id_materia': str(SUBJECT_IDS[i % len(SUBJECT_IDS)]),
+            'titolo': f'Esercizi {i + 1} pag. {i % 300} &amp; ripasso',
+        } for i in range(homework)]
+
+        self.feeds['agenda_plain'] = [{
+            'id': homework + i + 1,
+            'data': f'{start + timedelta(days=i % days)} {8 + i // days % LESSONS_PER_DAY:02}:00:00',
+            'sottotitolo': 'Verifica scritta',
+            'titolo': f'Capitoli {i % 20} e {i % 20 + 1} &egrave; tutto',
+        } for i in range(tests)]
+
+        self.feeds['orario_plain'] = [{
+            'data_ora_inizio': datetime.combine(day, datetime.min.time()).replace(hour=8 + hour).isoformat(),
+            'data_ora_fine': datetime.combine(day, datetime.min.time()).replace(hour=9 + hour).isoformat(),
+            'id_materia': str(SUBJECT_IDS[(day.weekday() + hour) % len(SUBJECT_IDS)]),
+        } for day in (start + timedelta(days=i) for i in range(timetable_days)) if day.weekday() < 6
+            for hour in range(LESSONS_PER_DAY)]
+
+        return {feed: len(items) for feed, items in self.feeds.items()}
+
+    def control_edit(self, feed: str = 'compiti_plain', changed: float = 0.0, removed: float = 0.0) -> dict:
+        '''Changes the title of the first changed fraction of a feed and drops its last removed fraction'''
+        items = self.feeds[feed]
+        changed_count = int(len(items) * changed)
+        removed_count = int(len(items) * removed)
+
+        for item in items[:changed_count]:
+            item['titolo'] += ' (modificato)'
+        del items[len(items) - removed_count:]
+
+        return {'changed': changed_count, 'removed': removed_count}
+
+    def respond(self, method: str, path: str, query: dict, headers, body: bytes) -> tuple:
+        if method == 'POST' and path.endswith('/utenti/login/'):
+            credentials = loads(body or b'{}')
+            if credentials.get('utente') != USERNAME or credentials.get('password') != PASSWORD:
+                return json_response(401, {'errore': 'Credenziali non valide'})
+            return json_response(200, {'token': TOKEN})
+
+        feed = path.rstrip('/').rsplit('/', 1)[-1]
+        if method != 'GET' or feed not in FEEDS + ('materie',):
+            return json_response(404, {'errore': 'Not found'})
+        if headers.get('Authorization') != f'JWT {TOKEN}':
+            return json_response(401, {'errore': 'Token non valido'})
+
+        if feed == 'materie':
+            items = SUBJECTS
+        else:
+            with self.lock:
+                items = [i for i in self.feeds[feed] if self._in_range(i, query)]
+        response = dumps(items).encode('utf8')
+        etag = '"' + sha1(response).hexdigest() + '"'
+
+        if headers.get('If-None-Match') == etag:
+            return 304, b'', {'ETag': etag}
+        return 200, response, {'Content-Type': 'application/json', 'ETag': etag}
+
+    @staticmethod
+    def _in_range(item: dict, query: dict) -> bool:
+        day = (item.get('data') or item['data_ora_inizio'])[:10]
+        return query.get('data_inizio', day) <= day <= query.get('data_fine', day)
+
+
+if __name__ == '__main__':
+    server = FakeMastercom(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    print(f'Fake Mastercom on {server.url}, BASE_URL = {base_url(server.url)}')
+    server.serve_forever()
@@ -0,0 +1,184 @@
+'''
+Base of the local stand-ins for the services the program talks to
+
+Every server counts the requests and bytes it exchanges and is driven through /_fake/<name>
+endpoints, which are not counted. FakeServerProcess runs a server in its own process, so that
+it shares neither memory nor the GIL with the code being measured.
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import Process, Pipe
+from threading import Lock
+from time import sleep
+from urllib.parse import urlsplit, parse_qsl
+from urllib.request import urlopen, Request
+from json import loads, dumps
+
+
+def json_response(status: int, value, headers: dict = None) -> tuple:
+    body = dumps(value).encode('utf8') if value is not None else b''
+    return status, body, dict({'Content-Type': 'application/json; charset=UTF-8'}, **(headers or {}))
+
+
+class _CountingReader:
+    def __init__(self, file) -> None:
+        self._file = file
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self.count += len(data)
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        data = self._file.readline(size)
+        self.count += len(data)
+        return data
+
+    def __getattr__(self, name: str):
+        return getattr(self._file, name)
+
+
+class _CountingWriter:
+    def __init__(self, file) -> None:
+        self._file = file
+        self.count = 0
+
+    def write(self, data: bytes) -> int:
+        self.count += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._file, name)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real services
+
+    def setup(self):
+        super().setup()
+        self.rfile = _CountingReader(self.rfile)
+        self.wfile = _CountingWriter(self.wfile)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if url.path.startswith('/_fake/'):
+            status, response_body, headers = self.server.control(url.path[len('/_fake/'):], loads(body or b'{}'))
+            self._send(status, response_body, headers)
+        else:
+            sleep(self.server.latency)
+            status, response_body, headers = self.server.respond(method, url.path, query, self.headers, body)
+            self._send(status, response_body, headers)
+            self.server.count(self.rfile.count, self.wfile.count)
+
+        self.rfile.count = self.wfile.count = 0
+
+    def _send(self, status: int, body: bytes, headers: dict):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeServer(ThreadingHTTPServer):
+    '''
+    A server answering on 127.0.0.1, every response is delayed by latency seconds
+
+    Subclasses implement respond(), and control_<name>(params) methods for the /_fake/<name> endpoints.
+    '''
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        super().__init__(('127.0.0.1', port), FakeHandler)
+        self.latency = latency
+        self.lock = Lock() # Held while the state of the service is read or changed
+        self.control_reset()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def respond(self, method: str, path: str, query: dict, headers, body: bytes) -> tuple:
+        '''Returns the (status, body, headers) of the response'''
+        raise NotImplementedError
+
+    def count(self, bytes_received: int, bytes_sent: int):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += bytes_received
+            self.stats['bytes_sent'] += bytes_sent
+
+    def control(self, name: str, params: dict) -> tuple:
+        control_function = getattr(self, f'control_{name}', None)
+
+        if control_function is None:
+            return json_response(404, {'error': f'Unknown control "{name}"'})
+        with self.lock:
+            return json_response(200, control_function(**params))
+
+    def control_stats(self) -> dict:
+        return dict(self.stats)
+
+    def control_reset(self) -> dict:
+        '''Resets the counters'''
+        self.stats = {'requests': 0, 'bytes_received': 0, 'bytes_sent': 0}
+        return self.stats
+
+
+def _serve(server_class, args: tuple, connection):
+    server = server_class(*args)
+    connection.send(server.url)
+    server.serve_forever()
+
+
+class FakeServerProcess:
+    '''Runs server_class(*args) in another process, usable as a context manager'''
+
+    def __init__(self, server_class, *args) -> None:
+        parent_connection, child_connection = Pipe()
+        self._process = Process(target=_serve, args=(server_class, args, child_connection), daemon=True)
+        self._process.start()
+        self.url = parent_connection.recv()
+
+    def control(self, name: str, **params):
+        request = Request(f'{self.url}/_fake/{name}', data=dumps(params).encode('utf8'), method='POST')
+        with urlopen(request) as response:
+            return loads(response.read())
+
+    def stats(self) -> dict:
+        return self.control('stats')
+
+    def reset(self) -> dict:
+        return self.control('reset')
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self) -> 'FakeServerProcess':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,46 @@
+from pathlib import Path
+from json import load
+from os import chdir
+
+from src.calendar_adder import CalendarAdder, AssignmentType
+from src.scheduler import PollingScheduler, load_holidays
+from src.sync_daemon import SyncDaemon
+from src.http_client import CachedHTTPClient
+from src.credentials import CredentialManager, mastercom_credential, google_credential, environment_login
+from main import MASTERCOM_TOKEN_PATH, GOOGLE_TOKEN_PATH, CALENDAR_ID_PATH, GOOGLE_BATCH_SIZE, SYNC_TIMETABLE
+
+
+# File in cui il daemon scrive le metriche
+DAEMON_METRICS_PATH = Path('config/metrics.prom')
+
+# Secondi per cui una risposta di Mastercom viene riusata senza richiesta, più breve dell'intervallo minimo del
+# PollingScheduler (10 minuti), così ogni sincronizzazione scarica davvero i compiti (con ETag, quindi spesso solo un 304)
+DAEMON_HTTP_TTL = 60
+
+
+# Funzione main
+if __name__ == '__main__':
+    chdir(Path(__file__).parent) # Assicura che il programma possa accedere agli altri file nella cartella
+
+    if not MASTERCOM_TOKEN_PATH.exists() or not GOOGLE_TOKEN_PATH.exists():
+        print('[i] Required files not found, make shure you run setup.py before this file')
+        exit()
+
+    # Recupera dal file l'ID del calendario
+    with open(CALENDAR_ID_PATH, 'r') as file:
+        calendar_id = load(file)['calendar_id']
+
+    # I client e il mirror del calendario restano in memoria tra una sincronizzazione e l'altra
+    calendar_adder = CalendarAdder.from_tokens(MASTERCOM_TOKEN_PATH, GOOGLE_TOKEN_PATH, calendar_id=calendar_id, batch_size=GOOGLE_BATCH_SIZE,
+        mastercom_client=CachedHTTPClient(ttl=DAEMON_HTTP_TTL))
+    scheduler = PollingScheduler(holidays=load_holidays()) # Le vacanze vengono lette da config/holidays.json
+
+    # L'orario viene sincronizzato solo se SYNC_TIMETABLE (in main.py) è True
+    types = (AssignmentType.HOMEWORK, AssignmentType.TEST) + ((AssignmentType.TIMETABLE,) if SYNC_TIMETABLE else ())
+
+    # I token vengono rinnovati in background prima della scadenza e salvati nei rispettivi file,
+    # quello di Mastercom solo se sono impostate MASTERCOM_USERNAME e MASTERCOM_PASSWORD
+    credentials = CredentialManager([mastercom_credential(MASTERCOM_TOKEN_PATH, environment_login()), google_credential(GOOGLE_TOKEN_PATH)])
+
+    # Dopo ogni sincronizzazione le metriche vengono scritte in formato Prometheus, ad esempio per il textfile collector di node_exporter
+    SyncDaemon(calendar_adder, scheduler, types=types, metrics_path=DAEMON_METRICS_PATH, credentials=credentials).run() # Sincronizza finché non riceve SIGINT o SIGTERM
@@ -0,0 +1,29 @@
+from pathlib import Path
+from os import chdir
+
+from src.fleet import FLEET_PATH, load_fleet, sync_fleet
+from main import GOOGLE_BATCH_SIZE
+
+
+# Numero massimo di studenti sincronizzati in contemporanea
+FLEET_MAX_WORKERS = 4
+
+
+# Funzione main
+if __name__ == '__main__':
+    chdir(Path(__file__).parent) # Assicura che il programma possa accedere agli altri file nella cartella
+
+    if not FLEET_PATH.exists():
+        print('[i] Fleet configuration not found, run "python setup.py <name>" for every student')
+        exit()
+
+    results = sync_fleet(load_fleet(), max_workers=FLEET_MAX_WORKERS, batch_size=GOOGLE_BATCH_SIZE)
+
+    # Stampa un riassunto per ogni studente, gli errori di uno non fermano gli altri
+    for result in results:
+        print(f'[{result.member.name}]')
+
+        if result.error is not None:
+            print(f'[!] Sincronizzazione fallita: {result.error}\n')
+        else:
+            result.calendar_adder.print_tally(compact=True)
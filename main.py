@@ -1,8 +1,17 @@
 from pathlib import Path
 from json import load
 from os import chdir
+from sys import argv
+from cProfile import Profile
+from pstats import Stats
 
 from src.calendar_adder import CalendarAdder, AssignmentType
+from src.scheduler import RunLock
+from src.metrics import metrics
+from src.mastercom import MastercomAPI
+from src.ics import IcsSink, IcsFeedServer, ICS_PATH, ICS_FEED_PORT
+from src.fan_out import FanOut, DESTINATIONS_PATH, load_destinations
+from src.credentials import CredentialManager, mastercom_credential, google_credential, environment_login
 
 
 # Percorsi dei file necessari al programma
@@ -16,11 +25,48 @@ MASTERCOM_URL_ID = 'giovio-co-sito'
 MASTERCOM_SCHOOL_ID = 'giovio-co'
 MASTERCOM_STUDENT_ID = 1005465
 
+# Numero massimo di modifiche al calendario inviate in una singola richiesta (0 per disattivare)
+GOOGLE_BATCH_SIZE = 50
+
+# Se True viene aggiunto anche l'orario delle lezioni, come eventi ricorrenti (per una singola esecuzione: "python main.py --timetable")
+SYNC_TIMETABLE = False
+
+# File delle metriche (aggiunte come righe JSON, o in formato Prometheus se il file termina con .prom) e del profilo
+METRICS_PATH = Path('config/metrics.jsonl')
+PROFILE_PATH = Path('config/sync.prof')
+
 
 # Funzione main
 if __name__ == '__main__':
     chdir(Path(__file__).parent) # Assicura che il programma possa accedere agli altri file nella cartella
 
+    # Tipi sincronizzati: compiti, verifiche e, se richiesto, l'orario
+    assignment_types = [AssignmentType.HOMEWORK, AssignmentType.TEST]
+    if SYNC_TIMETABLE or '--timetable' in argv:
+        assignment_types.append(AssignmentType.TIMETABLE)
+
+    # Con "python main.py --ics" i compiti e le verifiche vengono scritti in ICS_PATH invece che su Google Calendar,
+    # con "--serve" il file viene anche pubblicato su http://<indirizzo>:ICS_FEED_PORT/ per i calendari che vi si iscrivono
+    if '--ics' in argv:
+        if not MASTERCOM_TOKEN_PATH.exists():
+            print('[i] Required files not found, make shure you run setup.py before this file')
+            exit()
+
+        ics_sink = IcsSink(MastercomAPI.from_token_file(MASTERCOM_TOKEN_PATH))
+        for e in CredentialManager([mastercom_credential(MASTERCOM_TOKEN_PATH, environment_login())]).ensure_fresh():
+            print(f'[!] Rinnovo delle credenziali fallito: {e}')
+        with RunLock():
+            ics_sink.sync(assignment_types) # Nessuna richiesta a Google
+        ics_sink.print_tally(compact=True)
+
+        if '--serve' in argv:
+            print(f'[i] Calendario disponibile su http://localhost:{ICS_FEED_PORT}/{ICS_PATH.name}, premere Ctrl+C per chiudere')
+            try:
+                IcsFeedServer(ICS_PATH).serve_forever()
+            except KeyboardInterrupt:
+                pass
+        exit()
+
     if not MASTERCOM_TOKEN_PATH.exists() or not GOOGLE_TOKEN_PATH.exists():
         print('[i] Required files not found, make shure you run setup.py before this file')
         exit()
@@ -29,11 +75,71 @@ if __name__ == '__main__':
     with open(CALENDAR_ID_PATH, 'r') as file:
         calendar_id = load(file)['calendar_id']
 
+    # Rinnova i token che scadono a breve (quello di Mastercom solo se sono impostate MASTERCOM_USERNAME e MASTERCOM_PASSWORD),
+    # durante la sincronizzazione vengono rinnovati in background
+    credentials = CredentialManager([mastercom_credential(MASTERCOM_TOKEN_PATH, environment_login()), google_credential(GOOGLE_TOKEN_PATH)])
+    for e in credentials.ensure_fresh():
+        print(f'[!] Rinnovo delle credenziali fallito: {e}')
+
     # Utilizza CalendarAdder
-    calendar_adder = CalendarAdder.from_tokens(MASTERCOM_TOKEN_PATH, GOOGLE_TOKEN_PATH, calendar_id=calendar_id) # Inizializza CalendarAdder con l'ID
+    calendar_adder = CalendarAdder.from_tokens(MASTERCOM_TOKEN_PATH, GOOGLE_TOKEN_PATH, calendar_id=calendar_id, batch_size=GOOGLE_BATCH_SIZE) # Inizializza CalendarAdder con l'ID
+
+    # Con "python main.py --refresh-subjects" le materie e i docenti vengono richiesti di nuovo al registro invece di usare la cache
+    if '--refresh-subjects' in argv:
+        calendar_adder.mastercom.invalidate_subjects()
+
+    # Con "python main.py --plan" vengono mostrate le modifiche senza applicarle
+    if '--plan' in argv:
+        for assignment_type in assignment_types:
+            print(f'[{assignment_type.value}]')
+            calendar_adder.plan(assignment_type).print()
+        exit()
+
+    # Con "python main.py --backfill" vengono aggiunti i compiti e le verifiche dell'intero anno scolastico, un mese alla volta
+    if '--backfill' in argv:
+        with RunLock():
+            calendar_adder.backfill([AssignmentType.HOMEWORK, AssignmentType.TEST])
+        calendar_adder.print_tally(compact=True)
+        exit()
+
+    # Se esiste DESTINATIONS_PATH, ad esempio [{"name": "genitore", "calendar_id": "..."}], i compiti vengono aggiunti
+    # anche a quei calendari (o a un file .ics se manca "calendar_id"), in contemporanea e con un solo download
+    fan_out = None
+    if DESTINATIONS_PATH.exists():
+        sinks = {'principale': calendar_adder}
+        for destination in load_destinations():
+            sinks[destination.name] = destination.sink(calendar_adder.mastercom, GOOGLE_TOKEN_PATH, GOOGLE_BATCH_SIZE)
+        fan_out = FanOut(calendar_adder.mastercom, sinks)
+
+    # Con "python main.py --profile" la sincronizzazione viene eseguita con cProfile (solo il thread principale, non i download), il profilo viene salvato in PROFILE_PATH
+    profile = Profile() if '--profile' in argv else None
+
+    with RunLock(): # Impedisce che due sincronizzazioni (ad esempio con daemon.py) avvengano in contemporanea
+        credentials.start()
+        if profile is not None:
+            profile.enable()
+        if fan_out is None:
+            calendar_adder.sync(assignment_types) # Scarica in parallelo compiti (tipo HOMEWORK), verifiche (tipo TEST) ed eventualmente l'orario e li aggiunge al calendario
+        else:
+            fan_out_errors = fan_out.sync(assignment_types) # Un solo download per tutti i calendari
+        if profile is not None:
+            profile.disable()
+        credentials.stop()
+
+    # Stampa un riassunto delle operazioni eseguite
+    if fan_out is None:
+        calendar_adder.print_tally()
+    else:
+        fan_out.print_tally(fan_out_errors)
+
+    if profile is not None:
+        profile.dump_stats(PROFILE_PATH)
+        Stats(profile).sort_stats('cumulative').print_stats(20) # Mostra le 20 funzioni con il tempo cumulativo maggiore
+        print(f'[i] Profilo salvato in {PROFILE_PATH}')
 
-    calendar_adder.add_all(AssignmentType.HOMEWORK) # Aggiunge al calendario i compiti (tipo HOMEWORK)
-    calendar_adder.add_all(AssignmentType.TEST) # Aggiunge al calendario le verifiche (tipo TEST)
-    calendar_adder.print_tally() # Stampa un riassunto delle operazioni eseguite
+    # Con "python main.py --metrics" vengono salvati tempi, richieste e risultati della sincronizzazione
+    if '--metrics' in argv:
+        metrics.write(METRICS_PATH)
+        print(f'[i] Metriche salvate in {METRICS_PATH}')
 
     input('\nPremere invio per chiudere la finestra') # Aspetta l'input dell'utente prima di chiudere la finestra
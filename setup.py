@@ -1,6 +1,7 @@
 from pathlib import Path
 from json import dump
 from os import system, chdir
+from sys import argv
 
 chdir(Path(__file__).parent) # Assicura che il programma possa accedere agli altri file nella cartella
 
@@ -9,15 +10,35 @@ system("pip install -r requirements.txt")
 print()
 
 from src.google_calendar import API_SCOPES
-from src.calendar_adder import ADDED_EVENTS_PATH
 from src.google_api import GoogleAPI
 from src.mastercom import get_token
+from src.fleet import FleetMember, FLEET_PATH, load_fleet, save_fleet
 from main import CALENDAR_ID_PATH, GOOGLE_TOKEN_PATH, GOOGLE_CREDS_PATH, MASTERCOM_TOKEN_PATH, MASTERCOM_URL_ID, MASTERCOM_SCHOOL_ID, MASTERCOM_STUDENT_ID
 
 
 if __name__ == '__main__':
     chdir(Path(__file__).parent) # Assicura che il programma possa accedere agli altri file nella cartella
 
+    # Con "python setup.py <nome>" viene aggiunto uno studente alla flotta usata da fleet.py
+    member = None
+    mastercom_token_path = MASTERCOM_TOKEN_PATH
+    google_token_path = GOOGLE_TOKEN_PATH
+    mastercom_id = MASTERCOM_URL_ID
+    school_id = MASTERCOM_SCHOOL_ID
+    student_id = MASTERCOM_STUDENT_ID
+
+    if len(argv) > 1:
+        member = FleetMember(argv[1], calendar_id=None)
+        member.path.mkdir(parents=True, exist_ok=True)
+
+        mastercom_token_path = member.mastercom_token_path
+        google_token_path = member.google_token_path
+        # Gli studenti della flotta possono essere di scuole diverse
+        mastercom_id = input(f'Inserire l\'ID del registro, in https://<ID>.registroelettronico.com (lasciare vuoto per "{MASTERCOM_URL_ID}"): ') or MASTERCOM_URL_ID
+        school_id = input(f'Inserire l\'ID della scuola (lasciare vuoto per "{MASTERCOM_SCHOOL_ID}"): ') or MASTERCOM_SCHOOL_ID
+        student_id = int(input("Inserire l'ID dello studente: "))
+        member.class_id = input('Inserire la classe (lasciare vuoto per non condividere i compiti con altri studenti): ') or None
+
     # Setup per il registro elettronico
     print('[i] Username e password non verranno salvati')
 
@@ -26,7 +47,7 @@ if __name__ == '__main__':
         password = input('Inserire password del registro: ')
 
         try:
-            token = get_token(username, password, MASTERCOM_URL_ID, MASTERCOM_SCHOOL_ID)
+            token = get_token(username, password, mastercom_id, school_id)
         except ValueError:
             print('[!] Username o password errata')
         else:
@@ -34,23 +55,25 @@ if __name__ == '__main__':
 
     data_dict = {
         'token': token,
-        'mastercom_id': MASTERCOM_URL_ID,
-        'school_id': MASTERCOM_SCHOOL_ID,
-        'student_id': MASTERCOM_STUDENT_ID,
+        'mastercom_id': mastercom_id,
+        'school_id': school_id,
+        'student_id': student_id,
     }
 
-    with open(MASTERCOM_TOKEN_PATH, 'w+') as file:
+    with open(mastercom_token_path, 'w+') as file:
         dump(data_dict, file, indent=True)
 
     # Setup per Google Calendar
-    GoogleAPI.generate_token(API_SCOPES, GOOGLE_TOKEN_PATH, GOOGLE_CREDS_PATH)
+    GoogleAPI.generate_token(API_SCOPES, google_token_path, GOOGLE_CREDS_PATH)
 
     calendar_id = input("Inserire l'ID del calendario: ")
-    with open(CALENDAR_ID_PATH, 'w+') as file: # Salva l'ID in un file
-        dump({'calendar_id': calendar_id}, file)
 
-    if not ADDED_EVENTS_PATH.exists():
-        with open(ADDED_EVENTS_PATH, 'w+') as file:
-            dump({}, file)
+    if member is not None: # Salva lo studente nella flotta
+        member.calendar_id = calendar_id
+        fleet = [i for i in load_fleet() if i.name != member.name] if FLEET_PATH.exists() else []
+        save_fleet(fleet + [member])
+    else:
+        with open(CALENDAR_ID_PATH, 'w+') as file: # Salva l'ID in un file
+            dump({'calendar_id': calendar_id}, file)
 
     input('\n[i] Setup concluso, premere invio per chiudere la finestra') # Per evitare che si chiuda la finestra
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from pathlib import Path
+import os
+
+
+@contextmanager
+def atomic_write(path: Path, permissions: int = None, **open_arguments):
+    '''
+    Opens path.tmp for writing, it replaces path only when the block ends without errors
+
+    A crash or an error never leaves the file half written, readers see either the old or the new one.
+    permissions, for example 0o600, are those of a new file. Other arguments go to open().
+    '''
+    temp_path = path.with_name(path.name + '.tmp')
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+    try:
+        descriptor = os.open(temp_path, flags, permissions) if permissions is not None else os.open(temp_path, flags)
+        with open(descriptor, 'w', **open_arguments) as file:
+            yield file
+    except BaseException: # Also when a generator writing the file is closed early
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(temp_path, path)
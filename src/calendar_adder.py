@@ -1,16 +1,38 @@
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from hashlib import sha256
 from enum import Enum
-from json import load, dump
+from functools import partial
+from json import dumps
+from queue import Queue
 
-from .google_calendar import Event, Calendar, get_calendar_service, HttpError
-from .mastercom import MastercomAPI, Assignment, AssignmentType
+from .google_calendar import Event, Calendar, get_calendar_service, COMPARED_FIELDS
+from .google_api import GoogleAPI, http_error
+from .event_mirror import EventMirror, EVENT_MIRROR_PATH
+from .event_store import EventStore, SQLiteEventStore, ADDED_EVENTS_PATH, LEGACY_ADDED_EVENTS_PATH
+from .http_client import CachedHTTPClient
+from .rate_limit import get_limiter, DEFAULT_QPS
+from .mastercom import MastercomAPI, Assignment, AssignmentType, date_windows
+from .reconciler import AddResult, PlannedAction, Plan
+from .outbox import Outbox, Mutation
+from .timetable import compress_timetable, TIMEZONE
+from .prefetch import Prefetch
+from .metrics import metrics
 
 
-ADDED_EVENTS_PATH = Path('config/added_events.json')
+HASH_PROPERTY = 'autocalendarHash' # Private extended property holding content_hash()
 
 
+def content_hash(summary: str, description: str, start: dict, end: dict, color_id: int, recurrence: list = None) -> str:
+    '''Hashes the fields of an event that depend only on its assignment'''
+    fields = [summary, description, start, end, color_id] + ([recurrence] if recurrence is not None else [])
+    seed = dumps(fields, sort_keys=True)
+    return sha256(seed.encode('utf8')).hexdigest()
+
+
+
+@metrics.timed('body_from_assignment')
 def body_from_assignment(assignment: Assignment) -> dict:
     color_id = 0
     summary = ''
@@ -20,7 +42,7 @@ def body_from_assignment(assignment: Assignment) -> dict:
         description = ', '.join(i for i in [assignment.title, assignment.description] if i)
         summary = description.replace('\n', ' ').replace('\r', ' ').capitalize()
     elif assignment.kind == AssignmentType.HOMEWORK:
-        description = assignment.description
+        description = assignment.description or ''
         summary = ': '.join(i for i in [assignment.subject.capitalize(), assignment.description] if i) \
             .replace('\n', ' ').replace('\r', ' ')
     elif assignment.kind == AssignmentType.TIMETABLE:
@@ -30,10 +52,10 @@ def body_from_assignment(assignment: Assignment) -> dict:
         start = {'date': assignment.start.date().isoformat()}
         end = {'date': (assignment.start.date() + timedelta(days=1)).isoformat()}
     else: # In-day events
-        start = {'dateTime': assignment.start.isoformat()}
-        end = {'dateTime': assignment.end.isoformat()}
+        start = {'dateTime': assignment.start.isoformat(), 'timeZone': TIMEZONE}
+        end = {'dateTime': assignment.end.isoformat(), 'timeZone': TIMEZONE}
 
-    return {
+    body = {
         'summary': summary,
         'description': description + f' (Aggiunto il  {datetime.now().strftime("%d-%m-%Y")})',
 
@@ -41,113 +63,497 @@ def body_from_assignment(assignment: Assignment) -> dict:
         'end':   end,
 
         'colorId': color_id,
-        'transparency': 'transparent'}
+        'transparency': 'transparent',
+
+        'extendedProperties': {'private': {
+            HASH_PROPERTY: content_hash(summary, description, start, end, color_id, assignment.recurrence)}}}
+
+    if assignment.recurrence is not None:
+        body['recurrence'] = assignment.recurrence
+
+    return body
+
+
+def repr_events(events: list) -> str:
+    return '\n'.join(f'  ⦁ {(i.summary or "")[:100]}' for i in events)
+
+
+def series_inside(event: Event, start: datetime, end: datetime) -> bool:
+    '''True if every occurrence of a recurring event is between start and end, a series without UNTIL never is'''
+    rrule = next((i for i in event.recurrence if i.startswith('RRULE:')), '')
+    until = dict(i.split('=', 1) for i in rrule[len('RRULE:'):].split(';') if '=' in i).get('UNTIL')
+    if until is None:
+        return False
+
+    first = datetime.fromisoformat(event.start.get('dateTime') or event.start['date']).astimezone()
+    if 'T' in until:
+        last = datetime.strptime(until, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+    else:
+        last = datetime.strptime(until, '%Y%m%d').astimezone()
+
+    return start.astimezone() <= first and last <= end.astimezone()
+
+
+class ChangeDetection(Enum):
+    TEXT = 'text' # Compares summary and description, which include the date the event was added
+    HASH = 'hash' # Compares the content hash stored in the event
+
+
+def empty_tally() -> dict:
+    return {
+        AddResult.ADD: [],
+        AddResult.SKIP: [],
+        AddResult.PATCH: [],
+        AddResult.REMOVE: [],
+        AddResult.ERROR: []}
+
 
+def print_tally(result_tally: dict, destination: str, compact = False):
+    '''Prints the outcome of the writes of a sink to destination'''
+    added, patched, skipped, removed, errors = (result_tally[i] for i in
+        [AddResult.ADD, AddResult.PATCH, AddResult.SKIP, AddResult.REMOVE, AddResult.ERROR])
 
-class AddResult(Enum):
-    ADD = 'add'
-    SKIP = 'skip'
-    PATCH = 'patch'
+    print(f'Aggiungendo eventi a "{destination}"')
+    if compact:
+        print(f'Risultato: {len(added)} aggiunti, {len(patched)} aggiornati, {len(removed)} rimossi, {len(skipped)} saltati, {len(errors)} errori\n')
+    else:
+        print(f'''
+Eventi aggiunti ({len(added)}):
+{repr_events(added)}
+Eventi aggiornati ({len(patched)}):
+{repr_events(patched)}
+Eventi rimossi ({len(removed)}):
+{repr_events(removed)}
+Eventi saltati ({len(skipped)})
+Errori ({len(errors)}):
+''' + '\n'.join(f'  ⦁ {summary[:100]}: {error}' for summary, error in errors))
+
+
+def window_start(type: AssignmentType, only_future: bool) -> 'datetime | None':
+    '''The first day requested for a type, None for all of them'''
+    # The timetable is always requested for the whole year, so that the recurring events do not change every week
+    return datetime.now() if only_future and type != AssignmentType.TIMETABLE else None
+
+
+def fetch_assignments(fetch, type: AssignmentType, start: 'datetime | None'):
+    '''Calls fetch(type, start), the lessons of the timetable are merged in recurring series'''
+    assignments = fetch(type, start)
+    return compress_timetable(list(assignments)) if type == AssignmentType.TIMETABLE else assignments
+
+
+def write_streams(fetch, types: list, starts: dict, write, prepare = None):
+    '''
+    Streams every type from fetch(type, start) in a thread of its own, and calls write(assignments, type, start)
+    in the calling thread for each type, in the order their first assignment arrives
+
+    prepare() is called while the types are already downloading. A failed type does not prevent
+    writing the others, its ConnectionError is raised at the end.
+    '''
+    ready = Queue()
+    streams = {Prefetch(partial(fetch_assignments, fetch, t, starts[t]), ready=ready): t for t in types}
+
+    try:
+        if prepare is not None:
+            prepare()
+
+        error = None
+        for _ in types:
+            stream = ready.get()
+            try:
+                write(stream, streams[stream], starts[streams[stream]])
+            except ConnectionError as e:
+                error = error or e
+    finally:
+        for stream in streams:
+            stream.close()
+
+    if error is not None:
+        raise error
 
 
 @dataclass
 class CalendarAdder:
     calendar: Calendar
     mastercom: MastercomAPI
-    result_tally: dict = field(default_factory=lambda: {
-        AddResult.ADD: [],
-        AddResult.SKIP: [],
-        AddResult.PATCH: []})
+    batch_size: int = 0 # 0 disables batching, writes are sent one by one
+    mirror: EventMirror = None # Without a mirror every existing event is requested to Google
+    store: EventStore = None
+    change_detection: ChangeDetection = ChangeDetection.HASH
+    result_tally: dict = field(default_factory=empty_tally)
+
+    def __post_init__(self):
+        if self.store is None:
+            self.store = SQLiteEventStore(ADDED_EVENTS_PATH)
 
     @classmethod
-    def from_tokens(cls, mastercom_token_path: Path, google_token_path: Path, calendar_id: str):
-        with open(mastercom_token_path, 'r') as file:
-            mastercom_dict = load(file)
+    def from_tokens(cls,
+            mastercom_token_path: Path,
+            google_token_path: Path,
+            calendar_id: str,
+            batch_size: int = 0,
+            mirror_path: Path = EVENT_MIRROR_PATH,
+            store_path: Path = ADDED_EVENTS_PATH,
+            mastercom_client: CachedHTTPClient = None,
+            google_qps: float = DEFAULT_QPS,
+        ):
+        mastercom = MastercomAPI.from_token_file(mastercom_token_path, mastercom_client)
+        return cls.from_google_token(mastercom, google_token_path, calendar_id, batch_size, mirror_path, store_path, google_qps)
 
-        calendar = Calendar.from_id(get_calendar_service(google_token_path), calendar_id)
-        mastercom = MastercomAPI(
-            token=mastercom_dict['token'],
-            mastercom_id=mastercom_dict['mastercom_id'],
-            school_id=mastercom_dict['school_id'],
-            student_id=mastercom_dict['student_id']
-        )
+    @classmethod
+    def from_google_token(cls,
+            mastercom: MastercomAPI,
+            google_token_path: Path,
+            calendar_id: str,
+            batch_size: int = 0,
+            mirror_path: Path = EVENT_MIRROR_PATH,
+            store_path: Path = ADDED_EVENTS_PATH,
+            google_qps: float = DEFAULT_QPS,
+            private_service = False,
+        ):
+        '''
+        Creates a CalendarAdder for an existing MastercomAPI
 
-        return CalendarAdder(calendar, mastercom)
+        With private_service the Google service is not shared with other CalendarAdders of the same
+        token, so that they can write concurrently, as a service can only be used by one thread.
+        '''
+        # Every calendar of the same Google user shares the same quota
+        limiter = get_limiter(str(google_token_path), google_qps)
+        service = GoogleAPI.from_token(google_token_path).build('calendar', 'v3', shared=False) if private_service \
+            else get_calendar_service(google_token_path)
+        calendar = Calendar.from_id(service, calendar_id, limiter)
+
+        mirror = EventMirror(calendar, mirror_path) if mirror_path is not None else None
+        # Only the main store takes over the events of the old JSON file
+        store = SQLiteEventStore(store_path, LEGACY_ADDED_EVENTS_PATH if store_path == ADDED_EVENTS_PATH else None)
+
+        return CalendarAdder(calendar, mastercom, batch_size, mirror, store)
 
     def add_assignment(self, assignment: Assignment, existing_event: 'Event | None'):
-        body = body_from_assignment(assignment)
+        self.apply([self._plan_assignment(assignment, existing_event)])
+
+    def plan(self, type: AssignmentType, only_future = True) -> Plan:
+        '''Computes the changes add_all() would make, without writing anything'''
+        start = window_start(type, only_future)
+        assignments = fetch_assignments(self.mastercom.assignments, type, start)
+
+        self.prepare()
+
+        plan = Plan(list(self.iter_plan(assignments, type, start)), self.batch_size)
+        self.store.rollback() # Planning may re-key legacy IDs
+        return plan
+
+    def iter_plan(self, assignments, type: AssignmentType, start: datetime = None, remove_stale = True, bodies: dict = None):
+        '''
+        Yields a PlannedAction for every assignment, then one for every event whose assignment has disappeared
+
+        Only events of the same type added for days from start on are removed, as older
+        assignments are not requested to Mastercom. remove_stale=False disables removals,
+        for when assignments are only a part of the requested ones.
+        bodies maps unique IDs to bodies already computed by body_from_assignment().
+        '''
+        seen_ids = set()
+
+        for a in assignments:
+            seen_ids.add(a.unique_id)
+            event_id = self._event_id(a)
+            event = self._existing_event(event_id) if event_id is not None else None
+
+            yield self._plan_assignment(a, event, bodies.get(a.unique_id) if bodies is not None else None)
+
+        if not remove_stale:
+            return
 
-        if existing_event is not None:
-            if body['summary'] == existing_event.summary and body['description'] == existing_event.description:
-                self.result_tally[AddResult.SKIP].append(existing_event)
+        for unique_id, event_id in self.store.stale(type.value, start.date() if start is not None else None, seen_ids):
+            event = self._existing_event(event_id) or Event(self.calendar, {'id': event_id})
+            yield PlannedAction(AddResult.REMOVE, unique_id, event=event)
+
+    def _event_id(self, assignment: Assignment) -> 'str | None':
+        '''
+        Returns the ID of the event added for an assignment
+
+        Events added with the old identity scheme are re-keyed on the way. When several assignments
+        shared the same legacy ID the first one keeps the event, the others are added as new events.
+        '''
+        event_id = self.store.get(assignment.unique_id)
+
+        if event_id is None:
+            event_id = self.store.get(assignment.legacy_id)
+            if event_id is not None:
+                self.store.rekey(assignment.legacy_id, assignment.unique_id)
+
+        return event_id
+
+    def _plan_assignment(self, assignment: Assignment, existing_event: 'Event | None', body: dict = None) -> PlannedAction:
+        body = body if body is not None else body_from_assignment(assignment)
+
+        if existing_event is None:
+            result = AddResult.ADD
+        elif self._is_unchanged(existing_event, body):
+            result = AddResult.SKIP
+        else:
+            result = AddResult.PATCH
+
+        return PlannedAction(result, assignment.unique_id, assignment, body, existing_event)
+
+    def apply(self, actions):
+        '''
+        Applies the actions through the outbox of the store
+
+        Writes are queued and sent in batches of batch_size, together with the ones left
+        by previous runs. Those that fail stay in the outbox and are sent again in the next run.
+        '''
+        outbox = self.store.outbox()
+        chunk_size = self.batch_size or 1
+        last_seq = 0
+        queued = len(outbox)
+
+        try:
+            for action in actions:
+                if action.result == AddResult.SKIP:
+                    outbox.cancel(action.unique_id) # The event is already as it should be
+                    self.result_tally[AddResult.SKIP].append(action.event)
+                    metrics.count('sync_outcomes_total', result=AddResult.SKIP.value)
+                    self.store.set(action.unique_id, action.event.id, action.assignment.kind.value, action.assignment.start.date())
+                    continue
+
+                outbox.enqueue(Mutation.from_action(action))
+                queued += 1
+
+                if queued >= chunk_size:
+                    last_seq = self._drain(outbox, chunk_size, last_seq)
+                    queued = 0
+        finally: # What was planned before an error in the stream is still written
+            self._drain(outbox, chunk_size, last_seq)
+            self.store.commit() # Skipped events and rekeys are saved even if nothing was sent
+
+            if self.mirror is not None:
+                self.mirror.save()
+
+    def _drain(self, outbox: Outbox, chunk_size: int, last_seq: int = 0) -> int:
+        '''Sends every mutation after last_seq once, returns the last one sent'''
+        while True:
+            mutations = outbox.pending(chunk_size, last_seq)
+            if not mutations:
+                return last_seq
+
+            self.store.commit() # The mutations are durable before they are sent
+            self._send(mutations, outbox)
+            self.store.commit()
+
+            last_seq = mutations[-1].seq
+
+    def _send(self, mutations: list, outbox: Outbox):
+        batch = self.calendar.batch(len(mutations)) if self.batch_size else None
+
+        for m in mutations:
+            callback = self._on_written(m, outbox)
+            event = self._mutation_event(m) if m.result != AddResult.ADD else None
+            body = dict(m.body, id=m.event_id) if m.result == AddResult.ADD else m.body
+
+            if batch is not None:
+                if m.result == AddResult.ADD:
+                    batch.insert(body, callback)
+                elif m.result == AddResult.PATCH:
+                    batch.patch(event, body, callback)
+                elif m.result == AddResult.REMOVE:
+                    batch.remove(event, callback)
+                continue
+
+            try:
+                if m.result == AddResult.ADD:
+                    event = self.calendar.add(body)
+                elif m.result == AddResult.PATCH:
+                    event.patch(body)
+                elif m.result == AddResult.REMOVE:
+                    event.remove()
+            except http_error() as e:
+                callback(None, e)
             else:
-                existing_event.patch(body)
-                self.result_tally[AddResult.PATCH].append(existing_event)
+                callback(event, None)
+
+        if batch is not None:
+            batch.execute()
+
+    def _mutation_event(self, mutation: Mutation) -> Event:
+        event = self.mirror.event(mutation.event_id) if self.mirror is not None else None
+        return event if event is not None else Event(self.calendar, {'id': mutation.event_id, 'summary': mutation.summary})
+
+    def _is_unchanged(self, event: Event, body: dict) -> bool:
+        if self.change_detection == ChangeDetection.HASH:
+            private_properties = (event.extendedProperties or {}).get('private', {})
+            return private_properties.get(HASH_PROPERTY) == body['extendedProperties']['private'][HASH_PROPERTY]
         else:
-            existing_event = self.calendar.add(body)
-            self.result_tally[AddResult.ADD].append(existing_event)
+            return body['summary'] == event.summary and body['description'] == event.description
+
+    def _on_written(self, mutation: Mutation, outbox: Outbox):
+        '''Returns a CalendarBatch callback that records the outcome of a mutation'''
+        def callback(event: 'Event | None', error: 'Exception | None'):
+            status = error.resp.status if error is not None and isinstance(error, http_error()) else None
+
+            # A removed event that is already gone, or an added one that already exists, is not an error
+            if mutation.result == AddResult.REMOVE and status in (404, 410):
+                event, error = self._mutation_event(mutation), None
+            elif mutation.result == AddResult.ADD and status == 409:
+                event, error = Event(self.calendar, dict(mutation.body, id=mutation.event_id)), None
+
+            if error is not None:
+                self.result_tally[AddResult.ERROR].append((mutation.summary, error))
+                metrics.count('sync_outcomes_total', result=AddResult.ERROR.value)
+                outbox.failed(mutation)
+                return
+
+            outbox.done(mutation)
+            self.result_tally[mutation.result].append(event)
+            metrics.count('sync_outcomes_total', result=mutation.result.value)
+
+            if mutation.result == AddResult.REMOVE:
+                self.store.remove(mutation.unique_id)
+                if self.mirror is not None:
+                    self.mirror.discard(event.id)
+            else:
+                self._mirror_put(event)
+                self.store.set(mutation.unique_id, event.id, mutation.kind, mutation.start)
+
+        return callback
+
+    def _existing_event(self, event_id: str) -> 'Event | None':
+        if self.mirror is not None:
+            return self.mirror.event(event_id)
+
+        try:
+            return self.calendar.event(event_id)
+        except http_error():
+            return None
 
-            with open(ADDED_EVENTS_PATH, 'r') as file:
-                added_events = load(file)
-                added_events[assignment.unique_id] = existing_event.id
+    def prepare(self):
+        '''Brings the mirror up to date before write() is called'''
+        if self.mirror is not None:
+            self.mirror.sync()
 
-            with open(ADDED_EVENTS_PATH, 'w') as file:
-                dump(added_events, file, indent=True)
+    def write(self, assignments, type: AssignmentType, start: datetime = None, remove_stale = True, bodies: dict = None):
+        '''Adds the assignments of a type fetched by someone else, see iter_plan()'''
+        self.apply(self.iter_plan(assignments, type, start, remove_stale, bodies))
+
+    def _mirror_put(self, event: Event):
+        if self.mirror is not None:
+            self.mirror.put(event)
 
     def add_all(self,
             type: AssignmentType,
             only_future = True
         ):
-        start = datetime.now() if only_future else None
+        start = window_start(type, only_future)
 
-        with open(ADDED_EVENTS_PATH, 'r') as file:
-            added_events = load(file)
+        self.prepare()
 
-        if type == AssignmentType.TEST:
-            assignments = self.mastercom.tests(start)
-        elif type == AssignmentType.HOMEWORK:
-            assignments = self.mastercom.homework(start)
-        elif type == AssignmentType.TIMETABLE:
-            raise NotImplementedError('Adding timetable is not implemented')
-            assignments = self.mastercom.timetable(start)
+        # Assignments are planned and written while the response is still being downloaded
+        self.apply(self.iter_plan(fetch_assignments(self.mastercom.iter_assignments, type, start), type, start))
 
-        for a in assignments:
-            event_id = added_events.get(a.unique_id)
-            event = None
+    def sync(self,
+            types: list = (AssignmentType.HOMEWORK, AssignmentType.TEST),
+            only_future = True,
+            fetch = None
+        ):
+        '''
+        Like add_all() for every type, but fetches all of them concurrently
+
+        Every type is streamed by its own thread into a bounded queue, and the types are added
+        in the order their first assignment arrives, while the others are still downloading.
+        Calendar writes all happen in the calling thread, as the Google client is not thread safe.
+        fetch(type, start) replaces self.mastercom.iter_assignments, for example to share feeds.
+        '''
+        fetch = fetch if fetch is not None else self.mastercom.iter_assignments
+        starts = {t: window_start(t, only_future) for t in types}
+
+        write_streams(fetch, types, starts,
+            lambda assignments, type, start: self.apply(self.iter_plan(assignments, type, start)),
+            self.prepare)
+
+    def backfill(self,
+            types: list = (AssignmentType.HOMEWORK, AssignmentType.TEST),
+            window: timedelta = timedelta(days=31),
+            max_workers: int = 4
+        ):
+        '''
+        Adds the assignments of the whole school year, requesting windows of at most window days concurrently
 
-            if event_id is not None:
-                try:
-                    event = self.calendar.event(event_id)
-                except HttpError:
-                    pass
+        Each window is added as soon as it arrives and then marked as completed in the store, so an
+        interrupted backfill resumes from the missing windows. Nothing is removed during a backfill.
+        '''
+        if AssignmentType.TIMETABLE in types:
+            raise ValueError('The timetable is always requested for the whole year, use add_all() instead')
 
-            self.add_assignment(a, event)
+        year_start, year_end = self.mastercom.school_year_bounds()
 
-    def print_tally(self, compact = False):
-        added: list = self.result_tally[AddResult.ADD]
-        patched = self.result_tally[AddResult.PATCH]
-        skipped = self.result_tally[AddResult.SKIP]
+        self.prepare()
 
-        def repr_events(events):
-            return '\n'.join(f'  ⦁ {i.summary[:100]}' for i in events)
+        for type in types:
+            completed = self.store.completed_windows(type.value)
+            windows = [i for i in date_windows(year_start, year_end, window)
+                if (i[0].date(), i[1].date()) not in completed]
 
-        print(f'Aggiungendo eventi a "{self.calendar.summary}"')
-        if compact:
-            print(f'Risultato: {len(added)} aggiunti, {len(patched)} aggiornati, {len(skipped)} saltati\n')
-        else:
-            print(f'''
-Eventi aggiunti ({len(added)}):
-{repr_events(added)}
-Eventi aggiornati ({len(patched)}):
-{repr_events(patched)}
-Eventi saltati ({len(skipped)})
-''')
+            for (start, end), assignments in self.mastercom.backfill(type, windows, max_workers):
+                self.apply(self.iter_plan(assignments, type, remove_stale=False))
+                self.store.complete_window(type.value, start.date(), end.date())
+                self.store.commit()
+
+            self.store.clear_windows(type.value) # The next backfill starts from scratch
+            self.store.commit()
 
-    def remove_events(self, start: datetime, end: datetime):
-        events: list = self.calendar.events()
+    def reset_tally(self):
+        self.result_tally = empty_tally()
 
+    def print_tally(self, compact = False):
+        print_tally(self.result_tally, self.calendar.summary, compact)
+
+    def remove_events(self, start: datetime, end: datetime, dry_run = False) -> list:
+        '''
+        Removes the events added by this program between start and end, returns the removed events
+
+        Only the window is requested to the server, and only events in the store or with a content
+        hash are removed, in batches. A recurring series, such as a lesson of the timetable, is removed
+        only if all its occurrences are in the window. The store is updated in a single transaction.
+        With dry_run nothing is removed, the events that would be removed are printed and returned.
+        '''
+        added_event_ids = self.store.event_ids()
+        events = [e for e in self.calendar.iter_events(time_min=start, time_max=end, fields=COMPARED_FIELDS)
+            if (e.id in added_event_ids or HASH_PROPERTY in (e.extendedProperties or {}).get('private', {}))
+            and (not e.recurrence or series_inside(e, start, end))] # Removing a series removes every occurrence
+
+        if dry_run:
+            print(f'Eventi che verrebbero rimossi da "{self.calendar.summary}" ({len(events)}):')
+            print(repr_events(events))
+            return events
+
+        removed = []
+        outbox = self.store.outbox()
+
+        def on_removed(event: Event):
+            def callback(_, error: 'Exception | None'):
+                # An event that is already gone counts as removed, as in _on_written()
+                if error is not None and isinstance(error, http_error()) and error.resp.status in (404, 410):
+                    error = None
+
+                if error is not None:
+                    self.result_tally[AddResult.ERROR].append((event.summary or '', error))
+                    return
+
+                removed.append(event)
+                self.store.remove_event(event.id)
+                outbox.cancel_event(event.id) # Committed together with the store
+                if self.mirror is not None:
+                    self.mirror.discard(event.id)
+
+            return callback
+
+        batch = self.calendar.batch(self.batch_size or 50)
         for e in events:
-            event_date = datetime.fromisoformat(e.start['date'])
+            batch.remove(e, on_removed(e))
+        batch.execute()
+
+        self.store.commit()
+        if self.mirror is not None:
+            self.mirror.save()
 
-            if start < event_date < end:
-                e.remove()
\ No newline at end of file
+        self.result_tally[AddResult.REMOVE].extend(removed)
+        return removed
\ No newline at end of file
@@ -0,0 +1,266 @@
+from typing_extensions import Protocol
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Thread, Event
+from weakref import ref
+from base64 import urlsafe_b64decode
+from pathlib import Path
+from json import load, loads, dump
+import os
+
+from .metrics import metrics
+from .atomic_file import atomic_write
+
+
+REFRESH_MARGIN = timedelta(minutes=10) # Tokens are refreshed when they expire within this time
+CHECK_INTERVAL = timedelta(minutes=15) # Longest wait of CredentialManager between two checks
+RETRY_INTERVAL = timedelta(minutes=1) # Wait after a failed refresh
+
+# Mastercom has no refresh token, the credentials for a new login of the main token file are read from the environment
+MASTERCOM_USERNAME_VARIABLE = 'MASTERCOM_USERNAME'
+MASTERCOM_PASSWORD_VARIABLE = 'MASTERCOM_PASSWORD'
+
+
+def jwt_expiry(token: str) -> 'datetime | None':
+    '''Returns the expiry (the exp claim) of a JWT, or None if it has none or is not a JWT'''
+    try:
+        payload = token.split('.')[1]
+        claims = loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return datetime.fromtimestamp(claims['exp'], timezone.utc)
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def environment_login() -> 'tuple | None':
+    '''Returns (username, password) from MASTERCOM_USERNAME and MASTERCOM_PASSWORD, None if they are not set'''
+    if MASTERCOM_USERNAME_VARIABLE in os.environ and MASTERCOM_PASSWORD_VARIABLE in os.environ:
+        return os.environ[MASTERCOM_USERNAME_VARIABLE], os.environ[MASTERCOM_PASSWORD_VARIABLE]
+    return None
+
+
+def write_token_file(path: Path, token_dict: dict):
+    '''Replaces a token file at once, readable only by its owner, so that a crash never leaves it half written'''
+    with atomic_write(path, 0o600) as file:
+        dump(token_dict, file, indent=True)
+
+
+class ManagedCredential(Protocol):
+    '''
+    A token that is refreshed before it expires
+
+    Concurrent callers of ensure_fresh() share a single refresh: the first one refreshes,
+    the others wait for it and then find the token already fresh.
+    '''
+    kind = ''
+
+    def __init__(self, path: Path, margin: timedelta = REFRESH_MARGIN) -> None:
+        self.path = path
+        self.margin = margin
+        self._lock = Lock()
+
+    def expiry(self) -> 'datetime | None':
+        '''The expiry in UTC, None if unknown'''
+        ...
+
+    def needs_refresh(self, now: datetime = None) -> bool:
+        expiry = self.expiry()
+        now = now if now is not None else datetime.now(timezone.utc)
+        return expiry is not None and expiry - self.margin <= now
+
+    def ensure_fresh(self):
+        if not self.needs_refresh():
+            return
+
+        with self._lock:
+            if self.needs_refresh(): # Another thread may have refreshed it while we waited
+                with metrics.timed('credential_refresh', kind=self.kind):
+                    self._refresh()
+
+    def _refresh(self):
+        '''Gets a new token and writes it to the token file'''
+        ...
+
+
+class MastercomCredential(ManagedCredential):
+    '''
+    The JWT of a Mastercom token file, renewed with a new login, every attached MastercomAPI gets the new token
+
+    The login is the (username, password) of the account of this file, without one the token
+    is never renewed, so that a token file can never get the token of another account.
+    '''
+    kind = 'mastercom'
+
+    def __init__(self, path: Path, margin: timedelta = REFRESH_MARGIN, login: tuple = None) -> None:
+        super().__init__(path, margin)
+        self.login = login
+        self._apis = [] # Weak references, MastercomAPI objects are not hashable
+
+        with open(path, 'r') as file:
+            self.token_dict = load(file)
+
+    @property
+    def token(self) -> str:
+        return self.token_dict['token']
+
+    def attach(self, api):
+        '''Keeps the token of a MastercomAPI up to date'''
+        with self._lock:
+            self._apis = [i for i in self._apis if i() is not None] + [ref(api)]
+            api.token = self.token
+
+    def expiry(self) -> 'datetime | None':
+        return jwt_expiry(self.token)
+
+    def can_refresh(self) -> bool:
+        return self.login is not None
+
+    def needs_refresh(self, now: datetime = None) -> bool:
+        if self.can_refresh():
+            return super().needs_refresh(now)
+
+        # Without the password the token is used until it has actually expired
+        expiry = self.expiry()
+        return expiry is not None and expiry <= (now if now is not None else datetime.now(timezone.utc))
+
+    def _refresh(self):
+        if not self.can_refresh():
+            raise PermissionError(f'The Mastercom token of {self.path} has expired, run setup.py again')
+
+        from .mastercom import get_token # mastercom imports this module
+
+        username, password = self.login
+        token = get_token(
+            username,
+            password,
+            self.token_dict['mastercom_id'],
+            self.token_dict['school_id'])
+
+        self.token_dict = dict(self.token_dict, token=token)
+        write_token_file(self.path, self.token_dict)
+
+        for api_ref in self._apis:
+            api = api_ref()
+            if api is not None:
+                api.token = token
+
+
+class GoogleCredential(ManagedCredential):
+    '''
+    The OAuth credentials of a Google token file, renewed with the refresh token
+
+    The same Credentials object is used by every service built from the file, so they all
+    see the new access token. Tokens refreshed by the Google client itself are also saved.
+    '''
+    kind = 'google'
+
+    def __init__(self, path: Path, margin: timedelta = REFRESH_MARGIN) -> None:
+        super().__init__(path, margin)
+        from google.oauth2.credentials import Credentials
+
+        self.credentials = Credentials.from_authorized_user_file(str(path))
+        self._saved_token = self.credentials.token
+
+    def expiry(self) -> 'datetime | None':
+        # google-auth keeps naive UTC datetimes
+        expiry = self.credentials.expiry
+        return expiry.replace(tzinfo=timezone.utc) if expiry is not None else None
+
+    def ensure_fresh(self):
+        super().ensure_fresh()
+
+        with self._lock:
+            if self.credentials.token != self._saved_token:
+                self._save()
+
+    def _refresh(self):
+        from google.auth.transport.requests import Request
+
+        self.credentials.refresh(Request())
+        self._save()
+
+    def _save(self):
+        write_token_file(self.path, loads(self.credentials.to_json()))
+        self._saved_token = self.credentials.token
+
+
+_credentials = {}
+_credentials_lock = Lock()
+
+
+def _get_credential(credential_class, path: Path) -> ManagedCredential:
+    key = (credential_class, str(Path(path).resolve()))
+
+    with _credentials_lock:
+        if key not in _credentials:
+            _credentials[key] = credential_class(Path(path))
+        return _credentials[key]
+
+
+def mastercom_credential(path: Path, login: tuple = None) -> MastercomCredential:
+    '''
+    Returns the credential of a Mastercom token file, one for each file in the whole process
+
+    login, the (username, password) of the account of the file, enables the renewal of the token.
+    '''
+    credential = _get_credential(MastercomCredential, path)
+    if login is not None:
+        credential.login = login
+    return credential
+
+
+def google_credential(path: Path) -> GoogleCredential:
+    '''Returns the credential of a Google token file, one for each file in the whole process'''
+    return _get_credential(GoogleCredential, path)
+
+
+class CredentialManager:
+    '''Refreshes the credentials ahead of their expiry, with a background thread between start() and stop()'''
+
+    def __init__(self, credentials: list) -> None:
+        self.credentials = credentials
+        self._stop = Event()
+        self._thread = None
+
+    def ensure_fresh(self) -> list:
+        '''Refreshes the credentials that are about to expire now, returns the errors of the failed ones'''
+        errors = []
+
+        for credential in self.credentials:
+            try:
+                credential.ensure_fresh()
+            except Exception as e: # One failed refresh must not prevent the others
+                errors.append(e)
+
+        return errors
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            errors = self.ensure_fresh()
+            for e in errors:
+                print(f'[!] Rinnovo delle credenziali fallito: {e}')
+
+            self._stop.wait(self._next_check(failed=bool(errors)).total_seconds())
+
+    def _next_check(self, failed = False) -> timedelta:
+        '''Waits until the first credential needs a refresh, but at most CHECK_INTERVAL'''
+        if failed:
+            return RETRY_INTERVAL
+
+        now = datetime.now(timezone.utc)
+        wait = CHECK_INTERVAL
+
+        for credential in self.credentials:
+            expiry = credential.expiry()
+            if expiry is not None:
+                wait = min(wait, max(expiry - credential.margin - now, timedelta(0)))
+
+        return max(wait, RETRY_INTERVAL)
@@ -0,0 +1,96 @@
+from pathlib import Path
+from json import load, dump
+
+from .google_calendar import Event, EventRecord, Calendar, COMPARED_FIELDS
+from .google_api import http_error
+from .metrics import metrics
+from .atomic_file import atomic_write
+
+
+EVENT_MIRROR_PATH = Path('config/event_mirror.json')
+
+# Only the compared fields are mirrored, the sync token is on the last page
+MIRROR_FIELDS = f'nextPageToken,nextSyncToken,items({COMPARED_FIELDS})'
+
+
+class EventMirror:
+    '''
+    A local copy of the events of a calendar
+
+    The mirror is filled once with a full events.list and then kept up to date
+    with incremental sync tokens, so looking up an event never needs a request.
+    '''
+
+    def __init__(self, calendar: Calendar, path: Path = EVENT_MIRROR_PATH) -> None:
+        self._calendar = calendar
+        self.path = path
+        self.sync_token = None
+        self._events = {} # Event ID: EventRecord
+
+        if path.exists():
+            with metrics.timed('mirror_load'), open(path, 'r') as file:
+                mirror_dict = load(file)
+
+            # A mirror of another calendar is useless, it will be replaced by a full sync
+            if mirror_dict.get('calendar_id') == calendar.id:
+                self.sync_token = mirror_dict['sync_token']
+                self._events = {k: EventRecord(v) for k, v in mirror_dict['events'].items()}
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def __contains__(self, event_id: str) -> bool:
+        return event_id in self._events
+
+    def event(self, event_id: str) -> 'Event | None':
+        '''Returns the mirrored event with the given ID, or None if it is not in the calendar'''
+        record = self._events.get(event_id)
+        return Event(self._calendar, record.as_dict()) if record is not None else None
+
+    def events(self) -> list:
+        return [Event(self._calendar, record.as_dict()) for record in self._events.values()]
+
+    def put(self, event: Event):
+        '''Records an event written by this program, so that the mirror does not wait for the next sync'''
+        self._events[event.id] = EventRecord(event._dict)
+
+    def discard(self, event_id: str):
+        self._events.pop(event_id, None)
+
+    def sync(self):
+        '''Brings the mirror up to date, with a full sync if there is no valid sync token'''
+        if self.sync_token is None:
+            self._full_sync()
+        else:
+            try:
+                self._apply(self._calendar.event_pages(syncToken = self.sync_token, fields = MIRROR_FIELDS))
+            except http_error() as e:
+                if e.resp.status != 410: # 410 Gone: the sync token has expired
+                    raise
+                self._full_sync()
+
+        self.save()
+
+    def save(self):
+        '''Writes the mirror to a temporary file first, so that a crash never leaves it half written'''
+        with metrics.timed('mirror_save'), atomic_write(self.path) as file:
+            dump({
+                'calendar_id': self._calendar.id,
+                'sync_token': self.sync_token,
+                'events': {k: v.as_dict() for k, v in self._events.items()}}, file)
+
+    def _full_sync(self):
+        self._events = {}
+        self._apply(self._calendar.event_pages(maxResults = 2500, fields = MIRROR_FIELDS))
+
+    def _apply(self, pages):
+        for page in pages:
+            for event_dict in page.get('items', []):
+                if event_dict.get('status') == 'cancelled':
+                    self._events.pop(event_dict['id'], None)
+                else:
+                    self._events[event_dict['id']] = EventRecord(event_dict)
+
+            # Only the last page has a sync token
+            if 'nextSyncToken' in page:
+                self.sync_token = page['nextSyncToken']
@@ -0,0 +1,177 @@
+from typing_extensions import Protocol
+from datetime import date
+from pathlib import Path
+from json import load
+import sqlite3
+
+from .outbox import Outbox
+from .metrics import metrics
+
+
+ADDED_EVENTS_PATH = Path('config/added_events.db')
+LEGACY_ADDED_EVENTS_PATH = Path('config/added_events.json')
+
+SCHEMA_VERSION = 5
+
+
+class EventStore(Protocol):
+    '''Maps the unique_id of every added Assignment to the ID of its Google Calendar event'''
+
+    def get(self, unique_id: str) -> 'str | None':
+        ...
+
+    def set(self, unique_id: str, event_id: str, kind: str = None, start: date = None):
+        '''kind and start are needed to find the event with stale()'''
+        ...
+
+    def remove(self, unique_id: str):
+        ...
+
+    def rekey(self, old_unique_id: str, new_unique_id: str):
+        ...
+
+    def remove_event(self, event_id: str):
+        ...
+
+    def event_ids(self) -> set:
+        ...
+
+    def stale(self, kind: str, start: 'date | None', current_ids: set) -> list:
+        '''Returns (unique_id, event_id) of the assignments of a kind from start on that are not in current_ids'''
+        ...
+
+    def items(self) -> list:
+        ...
+
+    def outbox(self) -> Outbox:
+        ...
+
+    def completed_windows(self, kind: str) -> set:
+        '''Returns the (start, end) dates of the backfill windows already added'''
+        ...
+
+    def complete_window(self, kind: str, start: date, end: date):
+        ...
+
+    def clear_windows(self, kind: str):
+        ...
+
+    def commit(self):
+        '''Makes every change since the last commit durable, all at once'''
+        ...
+
+    def rollback(self):
+        '''Discards every change since the last commit, used by CalendarAdder.plan()'''
+        ...
+
+    def close(self):
+        ...
+
+
+class SQLiteEventStore:
+    '''An EventStore backed by an SQLite database, changes are written in a single transaction on commit()'''
+
+    def __init__(self, path: Path = ADDED_EVENTS_PATH, legacy_path: Path = LEGACY_ADDED_EVENTS_PATH) -> None:
+        self.path = path
+        # A store may be created in one thread and used in another, but never by two at the same time
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        self._migrate_schema()
+
+        if legacy_path is not None and legacy_path.exists():
+            self._migrate_json(legacy_path)
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def get(self, unique_id: str) -> 'str | None':
+        row = self._connection.execute(
+            'SELECT event_id FROM events WHERE unique_id = ?', (unique_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, unique_id: str, event_id: str, kind: str = None, start: date = None):
+        self._connection.execute(
+            'INSERT OR REPLACE INTO events (unique_id, event_id, kind, start) VALUES (?, ?, ?, ?)',
+            (unique_id, event_id, kind, start.isoformat() if start is not None else None))
+
+    def remove(self, unique_id: str):
+        self._connection.execute('DELETE FROM events WHERE unique_id = ?', (unique_id,))
+
+    def rekey(self, old_unique_id: str, new_unique_id: str):
+        self._connection.execute(
+            'UPDATE events SET unique_id = ? WHERE unique_id = ?', (new_unique_id, old_unique_id))
+
+    def remove_event(self, event_id: str):
+        self._connection.execute('DELETE FROM events WHERE event_id = ?', (event_id,))
+
+    def event_ids(self) -> set:
+        return {row[0] for row in self._connection.execute('SELECT event_id FROM events')}
+
+    def stale(self, kind: str, start: 'date | None', current_ids: set) -> list:
+        rows = self._connection.execute(
+            'SELECT unique_id, event_id FROM events WHERE kind = ? AND start >= ?',
+            (kind, start.isoformat() if start is not None else '')).fetchall()
+        return [row for row in rows if row[0] not in current_ids]
+
+    def items(self) -> list:
+        return self._connection.execute('SELECT unique_id, event_id FROM events').fetchall()
+
+    def commit(self):
+        with metrics.timed('store_commit'):
+            self._connection.commit()
+
+    def completed_windows(self, kind: str) -> set:
+        rows = self._connection.execute('SELECT start, end FROM backfill_windows WHERE kind = ?', (kind,))
+        return {(date.fromisoformat(start), date.fromisoformat(end)) for start, end in rows}
+
+    def complete_window(self, kind: str, start: date, end: date):
+        self._connection.execute(
+            'INSERT OR IGNORE INTO backfill_windows (kind, start, end) VALUES (?, ?, ?)',
+            (kind, start.isoformat(), end.isoformat()))
+
+    def clear_windows(self, kind: str):
+        self._connection.execute('DELETE FROM backfill_windows WHERE kind = ?', (kind,))
+
+    def outbox(self) -> Outbox:
+        '''Returns the Outbox in the same database, committed together with the store'''
+        return Outbox(self._connection)
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+    def _migrate_schema(self):
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+
+        if version < 1:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS events (unique_id TEXT PRIMARY KEY, event_id TEXT NOT NULL)')
+        if version < 2:
+            self._connection.execute('CREATE INDEX IF NOT EXISTS events_event_id ON events (event_id)')
+        if version < 3: # Rows added before have no kind, so they are never stale
+            self._connection.execute('ALTER TABLE events ADD COLUMN kind TEXT')
+            self._connection.execute('ALTER TABLE events ADD COLUMN start TEXT')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS events_kind_start ON events (kind, start)')
+        if version < 4:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, unique_id TEXT NOT NULL UNIQUE, result TEXT NOT NULL, '
+                'event_id TEXT, body TEXT, summary TEXT, kind TEXT, start TEXT, attempts INTEGER NOT NULL DEFAULT 0)')
+        if version < 5:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS backfill_windows (kind TEXT, start TEXT, end TEXT, PRIMARY KEY (kind, start, end))')
+
+        self._connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._connection.commit()
+
+    def _migrate_json(self, legacy_path: Path):
+        '''Imports the mapping of the old added_events.json file, which is then renamed so that it is imported only once'''
+        with open(legacy_path, 'r') as file:
+            added_events = load(file)
+
+        self._connection.executemany(
+            'INSERT OR IGNORE INTO events (unique_id, event_id) VALUES (?, ?)', added_events.items())
+        self._connection.commit()
+
+        legacy_path.rename(legacy_path.with_suffix('.json.migrated'))
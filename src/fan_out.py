@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing_extensions import Protocol
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from pathlib import Path
+from json import load, dump
+
+from .calendar_adder import CalendarAdder, body_from_assignment, window_start, fetch_assignments
+from .mastercom import MastercomAPI, AssignmentType
+from .ics import IcsSink
+
+
+DESTINATIONS_PATH = Path('config/destinations.json')
+DESTINATIONS_DIR = Path('config/destinations')
+
+
+class Sink(Protocol):
+    '''A destination of the assignments, like CalendarAdder and IcsSink'''
+    result_tally: dict
+
+    def prepare(self):
+        '''Called once before the first write()'''
+        ...
+
+    def write(self, assignments, type: AssignmentType, start: datetime = None, remove_stale = True, bodies: dict = None):
+        '''Adds the assignments of a type, bodies are the ones computed by body_from_assignment()'''
+        ...
+
+    def reset_tally(self):
+        ...
+
+    def print_tally(self, compact = False):
+        ...
+
+
+@dataclass
+class Destination:
+    '''A further calendar that receives the same assignments, with its own files in config/destinations/<name>/'''
+    name: str
+    calendar_id: str = None # Without a calendar ID the assignments are written to an .ics file
+    google_token_path: str = None # Another Google user, the main one by default
+
+    @property
+    def path(self) -> Path:
+        return DESTINATIONS_DIR / self.name
+
+    def sink(self, mastercom: MastercomAPI, google_token_path: Path, batch_size: int = 0) -> Sink:
+        '''Creates the sink, every destination has its own store, so events never mix between calendars'''
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        if self.calendar_id is None:
+            return IcsSink(mastercom, self.path / 'calendar.ics', self.name)
+
+        google_token_path = Path(self.google_token_path) if self.google_token_path is not None else google_token_path
+        return CalendarAdder.from_google_token(
+            mastercom,
+            google_token_path,
+            calendar_id=self.calendar_id,
+            batch_size=batch_size,
+            mirror_path=self.path / 'event_mirror.json',
+            store_path=self.path / 'added_events.db',
+            private_service=True) # Destinations are written concurrently
+
+
+def load_destinations(path: Path = DESTINATIONS_PATH) -> list:
+    with open(path, 'r') as file:
+        return [Destination(**i) for i in load(file)]
+
+
+def save_destinations(destinations: list, path: Path = DESTINATIONS_PATH):
+    with open(path, 'w+') as file:
+        dump([asdict(i) for i in destinations], file, indent=True)
+
+
+@dataclass
+class FanOut:
+    '''
+    Writes the assignments of a single Mastercom fetch to several sinks
+
+    Every type is downloaded and turned into event bodies once, then all the sinks write it
+    concurrently, each one with its own store and its own tally. Each sink is only used by
+    one thread at a time, so a CalendarAdder needs a Google service of its own.
+    '''
+    mastercom: MastercomAPI
+    sinks: dict = field(default_factory=dict) # Name: Sink
+    max_workers: int = 4
+
+    def sync(self,
+            types: list = (AssignmentType.HOMEWORK, AssignmentType.TEST),
+            only_future = True
+        ) -> dict:
+        '''Returns {name: error} for every sink, error is None for the ones that succeeded'''
+        starts = {t: window_start(t, only_future) for t in types}
+
+        # Feeds have their own threads, so that sinks waiting for them never fill the pool
+        with ThreadPoolExecutor(max_workers=len(types)) as fetch_executor, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as sink_executor:
+            feeds = {t: fetch_executor.submit(self._fetch, t, starts[t]) for t in types}
+            futures = {name: sink_executor.submit(self._sync_sink, sink, feeds, starts) for name, sink in self.sinks.items()}
+
+            return {name: future.exception() for name, future in futures.items()}
+
+    def reset_tally(self):
+        for sink in self.sinks.values():
+            sink.reset_tally()
+
+    def print_tally(self, errors: dict = None, compact = True):
+        for name, sink in self.sinks.items():
+            print(f'[{name}]')
+
+            if errors is not None and errors.get(name) is not None:
+                print(f'[!] Sincronizzazione fallita: {errors[name]}\n')
+            else:
+                sink.print_tally(compact=compact)
+
+    def _fetch(self, type: AssignmentType, start: 'datetime | None') -> tuple:
+        '''Returns the assignments of a type and their bodies, by unique ID'''
+        assignments = fetch_assignments(self.mastercom.assignments, type, start)
+        return assignments, {a.unique_id: body_from_assignment(a) for a in assignments}
+
+    def _sync_sink(self, sink: Sink, feeds: dict, starts: dict):
+        sink.prepare()
+        error = None
+
+        for type, feed in feeds.items():
+            try:
+                assignments, bodies = feed.result()
+            except ConnectionError as e: # A failed type should not prevent adding the others
+                error = error or e
+                continue
+
+            sink.write(assignments, type, starts[type], bodies=bodies)
+
+        if error is not None:
+            raise error
@@ -0,0 +1,141 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from json import load, dump
+from threading import Lock
+
+from .calendar_adder import CalendarAdder, AssignmentType
+from .http_client import CachedHTTPClient
+from .credentials import mastercom_credential, google_credential
+
+
+FLEET_PATH = Path('config/fleet.json')
+FLEET_DIR = Path('config/fleet')
+
+
+@dataclass
+class FleetMember:
+    '''A student whose assignments are synced to a calendar, with its files in config/fleet/<name>/'''
+    name: str
+    calendar_id: str
+    class_id: str = None # Students with the same class share the homework and tests feeds
+
+    @property
+    def path(self) -> Path:
+        return FLEET_DIR / self.name
+
+    @property
+    def mastercom_token_path(self) -> Path:
+        return self.path / 'mastercom_token.json'
+
+    @property
+    def google_token_path(self) -> Path:
+        return self.path / 'google_token.json'
+
+    def feed_key(self) -> tuple:
+        '''Members with the same key get the same assignments from Mastercom'''
+        with open(self.mastercom_token_path, 'r') as file:
+            mastercom_dict = load(file)
+
+        owner = ('class', self.class_id) if self.class_id is not None else ('student', mastercom_dict['student_id'])
+        return (mastercom_dict['mastercom_id'], mastercom_dict['school_id']) + owner
+
+
+def load_fleet(path: Path = FLEET_PATH) -> list:
+    with open(path, 'r') as file:
+        return [FleetMember(**i) for i in load(file)]
+
+
+def save_fleet(members: list, path: Path = FLEET_PATH):
+    with open(path, 'w+') as file:
+        dump([asdict(i) for i in members], file, indent=True)
+
+
+class SharedFeeds:
+    '''Makes concurrent requests for the same feed wait for a single fetch'''
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._feeds = {}
+
+    def fetch(self, key: tuple, fetch_function) -> list:
+        with self._lock:
+            future = self._feeds.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._feeds[key] = Future()
+
+        if not is_owner:
+            try:
+                return future.result()
+            except ConnectionError: # The owner's credentials may be the problem, try with ours
+                return fetch_function()
+
+        try:
+            result = fetch_function()
+        except Exception as e:
+            with self._lock:
+                del self._feeds[key]
+            future.set_exception(e)
+            raise
+
+        future.set_result(result)
+        return result
+
+
+@dataclass
+class FleetResult:
+    member: FleetMember
+    calendar_adder: CalendarAdder = None
+    error: Exception = None
+
+
+def sync_member(
+        member: FleetMember,
+        shared_feeds: SharedFeeds,
+        client: CachedHTTPClient,
+        types: tuple,
+        batch_size: int,
+    ) -> FleetResult:
+    '''Syncs a single member, any error is returned in the result instead of being raised'''
+    try:
+        # Members sharing a token file share a single refresh. Members have no Mastercom login of their own,
+        # so their token is only checked: an expired one fails with a clear error instead of a rejected request
+        mastercom_credential(member.mastercom_token_path).ensure_fresh()
+        google_credential(member.google_token_path).ensure_fresh()
+
+        calendar_adder = CalendarAdder.from_tokens(
+            member.mastercom_token_path,
+            member.google_token_path,
+            calendar_id=member.calendar_id,
+            batch_size=batch_size,
+            mirror_path=member.path / 'event_mirror.json',
+            store_path=member.path / 'added_events.db',
+            mastercom_client=client)
+        feed_key = member.feed_key()
+
+        def fetch(kind: AssignmentType, start):
+            return shared_feeds.fetch(
+                feed_key + (kind, start.date() if start is not None else None),
+                lambda: calendar_adder.mastercom.assignments(kind, start))
+
+        calendar_adder.sync(types, fetch=fetch)
+    except Exception as e: # One failed member must not stop the others
+        return FleetResult(member, error=e)
+
+    return FleetResult(member, calendar_adder)
+
+
+def sync_fleet(
+        members: list,
+        max_workers: int = 4,
+        types: tuple = (AssignmentType.HOMEWORK, AssignmentType.TEST),
+        batch_size: int = 50,
+    ) -> list:
+    '''Syncs all the members with a bounded pool of workers, returns a FleetResult for each one'''
+    shared_feeds = SharedFeeds()
+    client = CachedHTTPClient(pool_size=max_workers * len(types))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(sync_member, i, shared_feeds, client, types, batch_size) for i in members]
+        return [i.result() for i in futures]
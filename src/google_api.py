@@ -1,17 +1,49 @@
 # -*- coding: utf8 -*-
 from typing_extensions import Protocol
+from typing import TYPE_CHECKING
 from dataclasses import dataclass
 from pathlib import Path
+from json import load
+from threading import Lock
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build, Resource
-from google.oauth2.credentials import Credentials
+# The Google libraries are slow to import, they are imported only when they are used
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+    from google.oauth2.credentials import Credentials
+
+
+DISCOVERY_CACHE_PATH = Path('config/cache/discovery')
+
+_services = {}
+_services_lock = Lock()
+
+
+def http_error() -> type:
+    '''Returns googleapiclient's HttpError, for example in "except http_error() as e:"'''
+    from googleapiclient.errors import HttpError
+    return HttpError
+
+
+def discovery_document(service_name: str, version: str) -> dict:
+    '''
+    Returns the discovery document of a service without any request
+
+    A copy in config/cache/discovery/ takes precedence over the one bundled with googleapiclient.
+    '''
+    cached_path = DISCOVERY_CACHE_PATH / f'{service_name}.{version}.json'
+
+    if cached_path.exists():
+        with open(cached_path, 'r') as file:
+            return load(file)
+
+    from googleapiclient.discovery_cache import get_static_doc
+    from json import loads
+    return loads(get_static_doc(service_name, version))
 
 
 @dataclass
 class GoogleAPI:
-    credentials: Credentials
+    credentials: 'Credentials'
 
     @classmethod
     def generate_token(cls,
@@ -27,6 +59,9 @@ class GoogleAPI:
         else:
             creds = None
 
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
                 creds.refresh(Request())
@@ -41,29 +76,75 @@ class GoogleAPI:
 
     @classmethod
     def from_token(cls, token_path: Path) -> 'GoogleAPI':
-        '''Creates a GoogleAPI object from a token file'''
-        creds = Credentials.from_authorized_user_file(token_path)
-        return GoogleAPI(creds)
+        '''
+        Creates a GoogleAPI object from a token file
+
+        Every object of the same file shares its credentials, which are refreshed and saved
+        back to the file by credentials.google_credential().
+        '''
+        from .credentials import google_credential
+        return GoogleAPI(google_credential(token_path).credentials)
+
+    def build(self, service_name: str, version: str, shared = True) -> 'Resource':
+        '''
+        Returns a Resource object given the service name and version
+
+        Resources are built once per process for each credentials, from a local discovery document.
+        A Resource must not be used by more than one thread at a time, so threads that need
+        one of their own pass shared=False.
+        '''
+        if not shared:
+            from googleapiclient.discovery import build_from_document
+            return build_from_document(discovery_document(service_name, version), credentials=self.credentials)
+
+        key = (id(self.credentials), service_name, version)
+
+        with _services_lock:
+            if key not in _services:
+                from googleapiclient.discovery import build_from_document
 
-    def build(self, service_name: str, version: str) -> Resource:
-        '''Returns a Resource object given the service name and version'''
-        return build(service_name, version, credentials=self.credentials)
+                service = build_from_document(discovery_document(service_name, version), credentials=self.credentials)
+                # The credentials are kept so that their id() cannot be reused by other credentials
+                _services[key] = (self.credentials, service)
+
+            return _services[key][1]
+
+
+class _Field:
+    '''Reads an annotated attribute of a GoogleAPIObject from its dict, without going through __getattr__'''
+    __slots__ = ('name',)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj, owner = None):
+        if obj is None:
+            return self
+        return obj._dict.get(self.name)
 
 
 @dataclass(init=False)
 class GoogleAPIObject(Protocol):
     '''An abstraction of dictionary-based Google API objects'''
-    _service: Resource
+    __slots__ = ('_service', '_dict')
+    _service: 'Resource'
     _dict: dict
 
+    def __init_subclass__(cls, **kwargs) -> None:
+        '''Turns the annotated attributes of API fields into descriptors, once for every class'''
+        super().__init_subclass__(**kwargs)
+        for name in cls.__dict__.get('__annotations__', {}):
+            if not name.startswith('_') and name not in cls.__dict__:
+                setattr(cls, name, _Field(name))
+
     @classmethod
-    def from_id(cls, service: Resource, id: str):
+    def from_id(cls, service: 'Resource', id: str):
         '''Creates and updates an object by constructing an empty dict from the id'''
         obj = cls(service, {'id': id})
         obj._update()
         return obj
 
-    def __init__(self, service: Resource, source_dict: dict) -> None:
+    def __init__(self, service: 'Resource', source_dict: dict) -> None:
         self._service = service
         self._dict = source_dict
 
@@ -79,7 +160,5 @@ class GoogleAPIObject(Protocol):
         return iter(self._dict.items())
 
     def __getattr__(self, name: str):
-        if name in self.__annotations__.keys():
-            return self._dict.get(name)
-        else:
-            raise AttributeError(f'{self} has no attribute "{name}"')
\ No newline at end of file
+        # Only reached by attributes that are neither slots nor annotated API fields
+        raise AttributeError(f'{type(self).__name__} has no attribute "{name}"')
@@ -1,133 +1,306 @@
-# -*- coding: utf8 -*-
-from dataclasses import dataclass
-from pathlib import Path
-
-from googleapiclient.errors import HttpError
-
-from .google_api import GoogleAPI, GoogleAPIObject, Resource
-
-
-API_SCOPES = ['https://www.googleapis.com/auth/calendar', 'https://www.googleapis.com/auth/calendar.events']
-
-
-def get_calendar_service(token_path: Path):
-    google_api = GoogleAPI.from_token(token_path)
-    return google_api.build('calendar', 'v3')
-
-
-@dataclass(init=False)
-class Event(GoogleAPIObject):
-    kind: str
-    etag: str
-    id: str
-
-    status: str
-    htmlLink: str
-    created: str
-    updated: str
-    summary: str
-    description: str
-    location: str
-    colorId: str
-    creator: dict
-    organizer: dict
-
-    start: dict
-    end: dict
-    endTimeUnspecified: bool
-    recurrence: list
-    recurringEventId: str
-    originalStartTime: dict
-
-    transparency: str
-    visibility: str
-    iCalUID: str
-    sequence: int
-    attendees: list
-    attendeesOmitted: bool
-    extendedProperties: dict
-    hangoutLink: str
-    conferenceData: dict
-    gadget: dict
-    anyoneCanAddSelf: bool
-    guestsCanInviteOthers: bool
-    guestsCanModify: bool
-    guestsCanSeeOtherGuests: bool
-    privateCopy: bool
-    locked: bool
-    reminders: dict
-    source: dict
-    attachments: list
-    eventType: str
-
-    @classmethod
-    def from_id(cls, calendar: 'Calendar', id: str):
-        '''Creates and updates an object by constructing an empty dict from the id'''
-        event = cls(calendar, {'id': id})
-        event._update()
-        return event
-
-    def __init__(self, calendar: 'Calendar', source_dict: dict) -> None:
-        self._calendar = calendar
-        self._service = calendar._service
-        self._dict = source_dict
-        super().__init__(self._service, source_dict)
-
-    def remove(self):
-        self._service.events().delete(calendarId=self._calendar.id, eventId=self.id).execute()
-        del self
-
-    def patch(self, body: dict) -> 'Event': 
-        self._service.events().patch(calendarId=self._calendar.id, eventId=self.id, body=body).execute()
-        self._update()
-        return self
-
-    def _update(self):
-        try:
-            self._dict = self._service.events().get(calendarId=self._calendar.id, eventId=self.id).execute()
-        except HttpError as e:
-            raise HttpError(resp=e.resp, content=f"Error requesting event  with ID '{self.id}'")
-
-
-class Calendar(GoogleAPIObject):
-    kind: str
-    etag: str
-    id: str
-    summary: str
-    description: str
-    location: str
-    timeZone: str
-    conferenceProperties: list
-
-    @classmethod
-    def from_google_API(cls, google_API: GoogleAPI, source_dict: dict):
-        '''Builds a Google API service and creates a Calendar object using it'''
-        service = google_API.build('calendar', 'v3')
-        return cls(service, source_dict)
-
-    @classmethod
-    def from_google_API_and_id(cls, google_API: GoogleAPI, id: str):
-        '''Creates an object from Google API and an ID'''
-        service = google_API.build('calendar', 'v3')
-        return cls.from_id(service, id)
-
-    def __init__(self, service: Resource, source_dict: dict):
-        self._service = service
-        self._dict = source_dict
-        super().__init__(service, source_dict)
-
-    def events(self, max_results = 2000) -> list:
-        '''Gets all events in the calendar'''
-        events_resp = self._service.events().list(calendarId = self.id, maxResults = max_results).execute()
-        return [Event(self, event_dict) for event_dict in events_resp['items']]
-
-    def event(self, event_id: str) -> Event:
-        event_dict = self._service.events().get(calendarId = self.id, eventId = event_id).execute()
-        return Event(self, event_dict)
-
-    def add(self, body: dict) -> Event:
-        event_dict = self._service.events().insert(calendarId = self.id, body = body).execute()
-        return Event(self, event_dict)
-
-    def _update(self):
-        self._dict = self._service.calendars().get(calendarId = self.id).execute()
\ No newline at end of file
+# -*- coding: utf8 -*-
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from time import sleep
+
+from .google_api import GoogleAPI, GoogleAPIObject, http_error
+from .rate_limit import TokenBucket, get_limiter, is_quota_error, backoff_delay, execute
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+
+API_SCOPES = ['https://www.googleapis.com/auth/calendar', 'https://www.googleapis.com/auth/calendar.events']
+
+
+# The only event fields CalendarAdder compares, for use with fields=
+COMPARED_FIELDS = 'id,etag,status,summary,description,start,end,colorId,extendedProperties,recurrence'
+
+_calendar_services = {}
+_calendar_services_lock = Lock()
+
+
+def rfc3339(time: datetime) -> str:
+    '''Formats a datetime for the API, naive datetimes are in local time'''
+    return time.astimezone().isoformat()
+
+
+def get_calendar_service(token_path: Path) -> 'Resource':
+    '''Returns the Calendar service of a token file, built only once per process'''
+    with _calendar_services_lock:
+        if token_path not in _calendar_services:
+            _calendar_services[token_path] = GoogleAPI.from_token(token_path).build('calendar', 'v3')
+
+        return _calendar_services[token_path]
+
+
+class EventRecord:
+    '''
+    The compared fields of an event, without the rest of the API resource
+
+    Kept by EventMirror instead of the event dicts, as slots take a fraction of the memory of a dict.
+    '''
+    __slots__ = tuple(COMPARED_FIELDS.split(','))
+
+    def __init__(self, event_dict: dict) -> None:
+        for name in self.__slots__:
+            setattr(self, name, event_dict.get(name))
+
+    def as_dict(self) -> dict:
+        '''Returns the fields that are set, as in the projected API response'''
+        return {name: value for name, value in ((i, getattr(self, i)) for i in self.__slots__) if value is not None}
+
+
+@dataclass(init=False)
+class Event(GoogleAPIObject):
+    __slots__ = ('_calendar',)
+    kind: str
+    etag: str
+    id: str
+
+    status: str
+    htmlLink: str
+    created: str
+    updated: str
+    summary: str
+    description: str
+    location: str
+    colorId: str
+    creator: dict
+    organizer: dict
+
+    start: dict
+    end: dict
+    endTimeUnspecified: bool
+    recurrence: list
+    recurringEventId: str
+    originalStartTime: dict
+
+    transparency: str
+    visibility: str
+    iCalUID: str
+    sequence: int
+    attendees: list
+    attendeesOmitted: bool
+    extendedProperties: dict
+    hangoutLink: str
+    conferenceData: dict
+    gadget: dict
+    anyoneCanAddSelf: bool
+    guestsCanInviteOthers: bool
+    guestsCanModify: bool
+    guestsCanSeeOtherGuests: bool
+    privateCopy: bool
+    locked: bool
+    reminders: dict
+    source: dict
+    attachments: list
+    eventType: str
+
+    @classmethod
+    def from_id(cls, calendar: 'Calendar', id: str):
+        '''Creates and updates an object by constructing an empty dict from the id'''
+        event = cls(calendar, {'id': id})
+        event._update()
+        return event
+
+    def __init__(self, calendar: 'Calendar', source_dict: dict) -> None:
+        self._calendar = calendar
+        self._service = calendar._service
+        self._dict = source_dict
+        super().__init__(self._service, source_dict)
+
+    def remove(self):
+        execute(self._service.events().delete(calendarId=self._calendar.id, eventId=self.id), self._calendar._limiter)
+        del self
+
+    def patch(self, body: dict) -> 'Event':
+        # The patch response is the full updated resource, no need for another GET
+        self._dict = execute(
+            self._service.events().patch(calendarId=self._calendar.id, eventId=self.id, body=body),
+            self._calendar._limiter)
+        return self
+
+    def _update(self):
+        try:
+            self._dict = execute(
+                self._service.events().get(calendarId=self._calendar.id, eventId=self.id),
+                self._calendar._limiter)
+        except http_error() as e:
+            raise http_error()(resp=e.resp, content=f"Error requesting event  with ID '{self.id}'")
+
+
+class Calendar(GoogleAPIObject):
+    __slots__ = ('_limiter',)
+    kind: str
+    etag: str
+    id: str
+    summary: str
+    description: str
+    location: str
+    timeZone: str
+    conferenceProperties: list
+
+    @classmethod
+    def from_google_API(cls, google_API: GoogleAPI, source_dict: dict):
+        '''Builds a Google API service and creates a Calendar object using it'''
+        service = google_API.build('calendar', 'v3')
+        return cls(service, source_dict)
+
+    @classmethod
+    def from_google_API_and_id(cls, google_API: GoogleAPI, id: str):
+        '''Creates an object from Google API and an ID'''
+        service = google_API.build('calendar', 'v3')
+        return cls.from_id(service, id)
+
+    @classmethod
+    def from_id(cls, service: 'Resource', id: str, limiter: TokenBucket = None):
+        '''Creates and updates an object by constructing an empty dict from the id'''
+        calendar = cls(service, {'id': id}, limiter)
+        calendar._update()
+        return calendar
+
+    def __init__(self, service: 'Resource', source_dict: dict, limiter: TokenBucket = None):
+        self._service = service
+        self._dict = source_dict
+        self._limiter = limiter if limiter is not None else get_limiter()
+        super().__init__(service, source_dict)
+
+    def events(self, max_results: int = None, **filters) -> list:
+        '''Gets all events in the calendar, takes the same filters as iter_events()'''
+        return list(islice(self.iter_events(**filters), max_results))
+
+    def iter_events(self,
+            time_min: datetime = None,
+            time_max: datetime = None,
+            updated_min: datetime = None,
+            fields: str = None,
+            page_size: int = 250,
+            **params
+        ):
+        '''
+        Yields the events in the calendar, requesting the next page only when needed
+
+        The filters are applied by the server. fields limits the attributes that are
+        transferred, for example fields=COMPARED_FIELDS. Other params go to events.list.
+        '''
+        for page in self.event_pages(
+                timeMin = rfc3339(time_min) if time_min is not None else None,
+                timeMax = rfc3339(time_max) if time_max is not None else None,
+                updatedMin = rfc3339(updated_min) if updated_min is not None else None,
+                maxResults = page_size,
+                fields = f'nextPageToken,nextSyncToken,items({fields})' if fields is not None else None,
+                **params):
+            for event_dict in page.get('items', []):
+                yield Event(self, event_dict)
+
+    def event_pages(self, **params):
+        '''Yields every page of an events.list request, following nextPageToken'''
+        params = {k: v for k, v in params.items() if v is not None}
+        page_token = None
+
+        while True:
+            page = execute(self._service.events().list(calendarId = self.id, pageToken = page_token, **params), self._limiter)
+            yield page
+
+            page_token = page.get('nextPageToken')
+            if page_token is None:
+                return
+
+    def event(self, event_id: str) -> Event:
+        event_dict = execute(self._service.events().get(calendarId = self.id, eventId = event_id), self._limiter)
+        return Event(self, event_dict)
+
+    def add(self, body: dict) -> Event:
+        event_dict = execute(self._service.events().insert(calendarId = self.id, body = body), self._limiter)
+        return Event(self, event_dict)
+
+    def batch(self, batch_size: int = 50) -> 'CalendarBatch':
+        '''Returns a CalendarBatch that groups writes to this calendar'''
+        return CalendarBatch(self, batch_size)
+
+    def _update(self):
+        self._dict = execute(self._service.calendars().get(calendarId = self.id), self._limiter)
+
+
+class CalendarBatch:
+    '''
+    Groups event inserts, patches and deletes into Google API batch requests
+
+    Queued writes are sent as soon as batch_size of them are pending, call
+    execute() to send the remaining ones. Every callback is called with
+    (event, error), where exactly one of the two is None.
+    '''
+
+    def __init__(self, calendar: Calendar, batch_size: int = 50) -> None:
+        self._calendar = calendar
+        self._service = calendar._service
+        self.batch_size = batch_size
+        self._pending = []
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def insert(self, body: dict, callback) -> None:
+        request = lambda: self._service.events().insert(calendarId=self._calendar.id, body=body)
+        self._queue(request, lambda response: Event(self._calendar, response), callback)
+
+    def patch(self, event: Event, body: dict, callback) -> None:
+        def on_response(response: dict) -> Event:
+            event._dict = response
+            return event
+
+        request = lambda: self._service.events().patch(calendarId=self._calendar.id, eventId=event.id, body=body)
+        self._queue(request, on_response, callback)
+
+    def remove(self, event: Event, callback) -> None:
+        request = lambda: self._service.events().delete(calendarId=self._calendar.id, eventId=event.id)
+        self._queue(request, lambda response: event, callback)
+
+    def execute(self) -> None:
+        '''Sends all the pending writes'''
+        while self._pending:
+            chunk = self._pending[:self.batch_size]
+            self._pending = self._pending[self.batch_size:]
+            self._send(chunk)
+
+    def _queue(self, request, on_response, callback) -> None:
+        '''request is a function that builds the request, so that it can be rebuilt to be retried'''
+        self._pending.append((request, on_response, callback))
+
+        if len(self._pending) >= self.batch_size:
+            self.execute()
+
+    def _send(self, chunk: list, attempt: int = 0, max_retries: int = 5) -> None:
+        over_quota = []
+
+        def handle(request_id: str, response, exception):
+            item = chunk[int(request_id)]
+            _, on_response, callback = item
+
+            if is_quota_error(exception) and attempt < max_retries:
+                over_quota.append(item)
+            elif exception is not None:
+                callback(None, exception)
+            else:
+                callback(on_response(response), None)
+
+        batch = self._service.new_batch_http_request(callback=handle)
+        for i, (request, _, _) in enumerate(chunk):
+            batch.add(request(), request_id=str(i))
+
+        # Every call in the batch counts against the quota, execute() takes the last token
+        self._calendar._limiter.acquire(len(chunk) - 1)
+        metrics.count('google_batched_calls', len(chunk))
+        execute(batch, self._calendar._limiter)
+
+        # Only the calls that were over quota are sent again
+        if over_quota:
+            metrics.count('google_retries_total', len(over_quota), method='batched')
+            sleep(backoff_delay(attempt))
+            self._send(over_quota, attempt + 1, max_retries)
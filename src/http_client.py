@@ -0,0 +1,164 @@
+from pathlib import Path
+from hashlib import sha256
+from json import load, dump, dumps
+from time import time
+
+from requests import Session
+from requests.exceptions import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import metrics
+from .atomic_file import atomic_write
+
+
+CACHE_PATH = Path('config/cache/http')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _CountedRetry(Retry):
+    '''A Retry that counts every retry in mastercom_retries_total, by status code or error'''
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace) # Raises when retries are exhausted
+        reason = str(response.status) if response is not None else type(error).__name__
+        metrics.count('mastercom_retries_total', reason=reason)
+        return retry
+
+
+class CachedHTTPClient:
+    '''
+    An HTTP client that reuses connections, retries failed requests and caches GET responses on disk
+
+    A cached response younger than ttl seconds is returned without any request, an older one
+    is revalidated with If-None-Match/If-Modified-Since when the server sent an ETag/Last-Modified.
+    '''
+
+    def __init__(self,
+            cache_path: Path = CACHE_PATH,
+            ttl: float = 15 * 60,
+            timeout: tuple = (5, 30), # (connect, read) seconds
+            retries: int = 3,
+            backoff_factor: float = 0.5,
+            pool_size: int = 10,
+        ) -> None:
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.timeout = timeout
+
+        # Retry honours the Retry-After header of 429 and 503 responses
+        retry = _CountedRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url: str, headers: dict = None, params: dict = None) -> str:
+        '''Returns the text of the response, raises ConnectionError if the request failed'''
+        return ''.join(self.stream(url, headers, params))
+
+    def stream(self, url: str, headers: dict = None, params: dict = None, chunk_size: int = 64 * 1024):
+        '''
+        Yields the text of the response in chunks, raises ConnectionError if the request failed
+
+        A response read from the network is written to the cache while it is read, and is
+        cached only if it is read to the end.
+        '''
+        try:
+            yield from self._stream(url, headers, params, chunk_size)
+        except RequestException as e: # Refused connections, timeouts, exhausted retries, broken responses
+            raise ConnectionError(f'Request failed: {e}') from e
+
+    def _stream(self, url: str, headers: 'dict | None', params: 'dict | None', chunk_size: int):
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        headers = dict(headers or {})
+
+        cache_file = self._cache_file(url, params)
+        entry = self._read_cache(cache_file)
+
+        if entry is not None:
+            if time() - entry['fetched_at'] < self.ttl:
+                metrics.count('http_cache_total', result='hit')
+                yield from self._read_body(cache_file, chunk_size)
+                return
+
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.session.get(url, headers=headers, params=params, timeout=self.timeout, stream=True)
+
+        with response:
+            if response.status_code == 304 and entry is not None:
+                metrics.count('http_cache_total', result='revalidated')
+                entry['fetched_at'] = time()
+                self._write_cache(cache_file, entry)
+                yield from self._read_body(cache_file, chunk_size)
+                return
+
+            if response.status_code != 200:
+                raise ConnectionError(f'Request failed with status code {response.status_code}')
+
+            metrics.count('http_cache_total', result='miss')
+            response.encoding = response.encoding or 'utf-8'
+            chunks = response.iter_content(chunk_size, decode_unicode=True)
+
+            if self.ttl <= 0:
+                yield from chunks
+                return
+
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+
+            with atomic_write(cache_file.with_suffix('.body'), encoding='utf8') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+
+            self._write_cache(cache_file, {
+                'fetched_at': time(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')})
+
+    def invalidate(self):
+        '''Removes every cached response'''
+        if self.cache_path.exists():
+            for cache_file in self.cache_path.glob('*.json'):
+                cache_file.unlink()
+            for body_file in self.cache_path.glob('*.body'):
+                body_file.unlink()
+
+    def _cache_file(self, url: str, params: dict) -> Path:
+        key = sha256(dumps([url, params], sort_keys=True).encode('utf8')).hexdigest()
+        return self.cache_path / f'{key}.json'
+
+    def _read_cache(self, cache_file: Path) -> 'dict | None':
+        if self.ttl <= 0 or not cache_file.exists() or not cache_file.with_suffix('.body').exists():
+            return None
+
+        try:
+            with open(cache_file, 'r') as file:
+                return load(file)
+        except ValueError: # A corrupted entry is just a cache miss
+            return None
+
+    def _read_body(self, cache_file: Path, chunk_size: int):
+        with open(cache_file.with_suffix('.body'), 'r', encoding='utf8') as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _write_cache(self, cache_file: Path, entry: dict):
+        '''Writes the metadata of an entry, the body is written by stream()'''
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+
+        with atomic_write(cache_file) as file:
+            dump(entry, file)
@@ -0,0 +1,258 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from datetime import datetime, timezone
+from pathlib import Path
+from hashlib import sha256
+from json import load, dump
+from threading import Lock
+from os import stat
+
+from .calendar_adder import body_from_assignment, empty_tally, print_tally, window_start, write_streams, HASH_PROPERTY
+from .mastercom import MastercomAPI, AssignmentType
+from .reconciler import AddResult, PlannedAction
+from .timetable import TIMEZONE
+from .metrics import metrics
+from .atomic_file import atomic_write
+
+
+ICS_PATH = Path('config/autocalendar.ics')
+ICS_FEED_PORT = 8080
+
+PRODID = '-//Autocalendar//Mastercom//IT'
+
+# Definition of TIMEZONE, needed by the DTSTART and EXDATE of lessons
+VTIMEZONE = '''BEGIN:VTIMEZONE
+TZID:Europe/Rome
+BEGIN:DAYLIGHT
+TZOFFSETFROM:+0100
+TZOFFSETTO:+0200
+TZNAME:CEST
+DTSTART:19700329T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU
+END:DAYLIGHT
+BEGIN:STANDARD
+TZOFFSETFROM:+0200
+TZOFFSETTO:+0100
+TZNAME:CET
+DTSTART:19701025T030000
+RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU
+END:STANDARD
+END:VTIMEZONE'''.split('\n')
+
+
+def escape_text(text: str) -> str:
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line: str) -> str:
+    '''Splits a content line in lines of at most 75 octets, as RFC 5545 requires'''
+    encoded = line.encode('utf8')
+    if len(encoded) <= 75:
+        return line
+
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74 # Continuation lines start with a space
+        # Never split a multi-byte character
+        while size < len(encoded) and (encoded[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size].decode('utf8'))
+        encoded = encoded[size:]
+
+    return '\r\n '.join(parts)
+
+
+def ics_time(time: dict) -> str:
+    '''Formats the start or end of an event body as the value of DTSTART or DTEND, with its parameters'''
+    if 'date' in time:
+        return ';VALUE=DATE:' + time['date'].replace('-', '')
+    return f';TZID={time.get("timeZone", TIMEZONE)}:' + datetime.fromisoformat(time['dateTime']).strftime('%Y%m%dT%H%M%S')
+
+
+def vevent(unique_id: str, body: dict) -> str:
+    '''Renders an event body, as returned by body_from_assignment(), as a VEVENT'''
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{unique_id}@autocalendar',
+        'DTSTAMP:' + datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ'),
+        'DTSTART' + ics_time(body['start']),
+        'DTEND' + ics_time(body['end']),
+        'SUMMARY:' + escape_text(body['summary']),
+        'DESCRIPTION:' + escape_text(body['description']),
+        'TRANSP:' + body['transparency'].upper()]
+    lines += body.get('recurrence', [])
+    lines.append('END:VEVENT')
+
+    return '\r\n'.join(fold(i) for i in lines)
+
+
+class IcsSink:
+    '''
+    Writes the assignments to an iCalendar file, for clients that subscribe to it instead of a Google calendar
+
+    The VEVENT of every assignment is kept in a sidecar file together with its content hash,
+    so a sync renders only the assignments that changed and rewrites the file only if any did.
+    No Google API request is ever made.
+    '''
+
+    def __init__(self, mastercom: MastercomAPI, path: Path = ICS_PATH, name: str = 'Autocalendar') -> None:
+        self.mastercom = mastercom
+        self.path = path
+        self.cache_path = path.with_name(path.name + '.json')
+        self.name = name
+        self.result_tally = empty_tally()
+        self._entries = {} # Unique ID: {'hash', 'kind', 'start', 'summary', 'vevent'}
+        self._changed = not path.exists()
+
+        if self.cache_path.exists():
+            with metrics.timed('ics_cache_load'), open(self.cache_path, 'r') as file:
+                self._entries = load(file)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def prepare(self):
+        '''Nothing to bring up to date, the file is only written by this program'''
+
+    def write(self, assignments, type: AssignmentType, start: datetime = None, remove_stale = True, bodies: dict = None):
+        '''
+        Updates the VEVENTs of the assignments, and removes those of assignments of the same type
+        from start on that have disappeared, as CalendarAdder does. The file is saved at the end,
+        also when the assignments stop because of an error.
+        '''
+        try:
+            self._write(assignments, type, start, remove_stale, bodies)
+        finally:
+            self.save()
+
+    def _write(self, assignments, type: AssignmentType, start: 'datetime | None', remove_stale: bool, bodies: 'dict | None'):
+        seen_ids = set()
+
+        for a in assignments:
+            seen_ids.add(a.unique_id)
+            body = bodies.get(a.unique_id) if bodies is not None else None
+            body = body if body is not None else body_from_assignment(a)
+            content_hash = body['extendedProperties']['private'][HASH_PROPERTY]
+            entry = self._entries.get(a.unique_id)
+
+            if entry is not None and entry['hash'] == content_hash:
+                self.result_tally[AddResult.SKIP].append(PlannedAction(AddResult.SKIP, a.unique_id, a, body))
+                continue
+
+            result = AddResult.ADD if entry is None else AddResult.PATCH
+            self._entries[a.unique_id] = {
+                'hash': content_hash,
+                'kind': type.value,
+                'start': a.start.date().isoformat(),
+                'summary': body['summary'],
+                'vevent': vevent(a.unique_id, body)}
+            self._changed = True
+            self.result_tally[result].append(PlannedAction(result, a.unique_id, a, body))
+
+        if not remove_stale:
+            return
+
+        start_date = start.date().isoformat() if start is not None else None
+        for unique_id, entry in list(self._entries.items()):
+            if entry['kind'] == type.value and unique_id not in seen_ids and (start_date is None or entry['start'] >= start_date):
+                del self._entries[unique_id]
+                self._changed = True
+                self.result_tally[AddResult.REMOVE].append(
+                    PlannedAction(AddResult.REMOVE, unique_id, body={'summary': entry['summary']}))
+
+    def sync(self,
+            types: list = (AssignmentType.HOMEWORK, AssignmentType.TEST),
+            only_future = True
+        ):
+        '''Downloads every type concurrently, like CalendarAdder.sync(), the file is saved only if anything changed'''
+        starts = {t: window_start(t, only_future) for t in types}
+        write_streams(self.mastercom.iter_assignments, types, starts, self.write)
+
+    def render(self) -> str:
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+            'X-WR-CALNAME:' + escape_text(self.name), f'X-WR-TIMEZONE:{TIMEZONE}']
+        lines += VTIMEZONE
+        lines += [i['vevent'] for i in sorted(self._entries.values(), key=lambda i: i['start'])]
+        lines.append('END:VCALENDAR')
+
+        return '\r\n'.join(lines) + '\r\n'
+
+    def save(self):
+        '''Writes the file and its sidecar through temporary files, only if an event changed'''
+        if not self._changed:
+            return
+
+        with metrics.timed('ics_save'):
+            for path, write in [
+                    (self.path, lambda file: file.write(self.render())),
+                    (self.cache_path, lambda file: dump(self._entries, file))]:
+                with atomic_write(path, encoding='utf8', newline='') as file:
+                    write(file)
+
+        self._changed = False
+
+    def reset_tally(self):
+        self.result_tally = empty_tally()
+
+    def print_tally(self, compact = False):
+        print_tally(self.result_tally, self.path, compact)
+
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body = True):
+        try:
+            content, etag, last_modified = self.server.feed()
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+
+        if etag in [i.strip() for i in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/calendar; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', 'no-cache') # Clients revalidate, which costs a 304
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(content)
+
+
+class IcsFeedServer(ThreadingHTTPServer):
+    '''
+    Serves the iCalendar file at any path, with an ETag so that polling clients mostly get a 304
+
+    The file is read again only when its modification time or size changes.
+    '''
+    daemon_threads = True
+
+    def __init__(self, path: Path = ICS_PATH, host: str = '', port: int = ICS_FEED_PORT) -> None:
+        super().__init__((host, port), _FeedHandler)
+        self.path = path
+        self._cached = (None, None) # (file version, (content, etag, last modified))
+        self._lock = Lock()
+
+    def feed(self) -> tuple:
+        '''Returns the content of the file, its ETag and its Last-Modified date'''
+        file_stat = stat(self.path)
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        with self._lock:
+            if self._cached[0] != version:
+                content = self.path.read_bytes()
+                etag = '"' + sha256(content).hexdigest()[:32] + '"'
+                self._cached = (version, (content, etag, formatdate(file_stat.st_mtime, usegmt=True)))
+
+            return self._cached[1]
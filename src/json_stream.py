@@ -0,0 +1,71 @@
+from json import JSONDecoder
+
+
+_decoder = JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+
+def iter_json_array(chunks):
+    '''
+    Yields the items of a JSON array whose text arrives in chunks
+
+    Only the item being parsed is held in memory, not the whole array.
+    '''
+    chunks = iter(chunks)
+    buffer = ''
+    started = False
+    expect_item = True # False after an item, when only "," or "]" may follow
+    first = True # Nothing has been read after "[", so "]" closes an empty array
+
+    for chunk in chunks:
+        buffer += chunk
+        position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+
+            if position == len(buffer):
+                break
+            elif not started:
+                if buffer[position] != '[':
+                    raise ValueError('The response is not a JSON array')
+                position += 1
+                started = True
+            elif buffer[position] == ',':
+                if expect_item:
+                    raise ValueError('Unexpected "," in the JSON array')
+                position += 1
+                expect_item = True
+            elif buffer[position] == ']':
+                if expect_item and not first:
+                    raise ValueError('Unexpected "]" in the JSON array')
+                _check_end(buffer[position + 1:], chunks)
+                return
+            elif not expect_item:
+                raise ValueError('Missing "," between the items of the JSON array')
+            else:
+                try:
+                    item, end = _decoder.raw_decode(buffer, position)
+                except ValueError: # The item continues in the next chunk
+                    break
+
+                # An item is always followed by "," or "]", otherwise a number may have been cut in half
+                if end == len(buffer) or buffer[end] not in _WHITESPACE + ',]':
+                    break
+
+                position = end
+                expect_item = False
+                first = False
+                yield item
+
+        buffer = buffer[position:]
+
+    raise ValueError('The JSON array is truncated')
+
+
+def _check_end(rest: str, chunks):
+    '''Reads the source to its end, for example to cache the response, and raises if anything follows the array'''
+    for text in [rest, *chunks]:
+        if text.strip(_WHITESPACE):
+            raise ValueError('Unexpected data after the JSON array')
@@ -1,11 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from hashlib import sha256
+from time import perf_counter
 from html import unescape
 from json import loads
+from pathlib import Path
 from enum import Enum
 
-from requests import get, post
+from requests import post
+from requests.exceptions import RequestException
+
+from .http_client import CachedHTTPClient
+from .json_stream import iter_json_array
+from .metrics import metrics
+from .credentials import mastercom_credential
+from .subjects import Subject, SubjectCache, get_subject_cache
 
 # Workaround for platforms that do not natively support fromisoformat()
 try:
@@ -20,6 +30,7 @@ class AssignmentType(Enum):
     HOMEWORK = 'homework'
     TIMETABLE = 'timetable'
 
+# Names used when the registro does not list the subjects
 SUBJECT_NAME_MAP = {
     # Subject ID: Subject name
     1000114: 'Italiano',
@@ -39,6 +50,7 @@ REQUEST_MAP = {
     AssignmentType.TEST: 'agenda_plain',
     AssignmentType.HOMEWORK: 'compiti_plain',
     AssignmentType.TIMETABLE: 'orario_plain'}
+SUBJECTS_REQUEST = 'materie'
 
 BASE_URL = 'https://{}.registroelettronico.com/api/v{}'
 
@@ -56,7 +68,10 @@ def get_token(
         'password': password,
         'mastercom': school_id}
 
-    response = post(login_url, json=payload)
+    try:
+        response = post(login_url, json=payload, timeout=(5, 30))
+    except RequestException as e:
+        raise ConnectionError(f'Request failed: {e}') from e
 
     if response.status_code == 200:
         return loads(response.text)['token']
@@ -67,23 +82,133 @@ def get_token(
 
 
 
-@dataclass
+def _unescape(value):
+    '''Unescapes the HTML entities of strings, other values such as null are returned as they are'''
+    return unescape(value) if type(value) == str else value
+
+
+def date_windows(start: datetime, end: datetime, window: timedelta) -> list:
+    '''Splits the days from start to end, both included, in (start, end) windows of at most window'''
+    windows = []
+
+    while start <= end:
+        window_end = min(start + window - timedelta(days=1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+
+    return windows
+
+
+def _measured(chunks, request_type: AssignmentType):
+    '''Records the size of a response and the time spent waiting for it, leaving out the time spent by the consumer'''
+    elapsed = 0.0
+    size = 0
+    outcome = 'error'
+
+    try:
+        start = perf_counter()
+        for chunk in chunks:
+            elapsed += perf_counter() - start
+            size += len(chunk)
+            yield chunk
+            start = perf_counter()
+
+        elapsed += perf_counter() - start
+        outcome = 'ok'
+    finally:
+        metrics.observe('mastercom_request_seconds', elapsed, type=request_type.value)
+        metrics.count('mastercom_request_total', outcome=outcome, type=request_type.value)
+        metrics.count('mastercom_response_chars', size, type=request_type.value)
+
+
+def _subject_from_item(item: dict) -> Subject:
+    '''Parses a subject of the registro, teachers are either objects with nome and cognome or plain names'''
+    teachers = []
+    for teacher in item.get('docenti') or []:
+        if isinstance(teacher, dict):
+            teacher = ' '.join(unescape(teacher[k]) for k in ['nome', 'cognome'] if teacher.get(k))
+        teachers.append(teacher)
+
+    name = next((item[k] for k in ['descrizione', 'nome', 'materia'] if item.get(k)), '')
+    return Subject(int(item.get('id_materia') or item['id']), unescape(name).strip(), teachers)
+
+
 class Assignment:
-    start: datetime
-    kind: AssignmentType
-    unique_id: str = None
+    '''
+    An assignment of Mastercom, a lesson or a series of lessons of the timetable
+
+    A class with __slots__ rather than a dataclass, as a fleet keeps a great many of them. The unique
+    ID is hashed from the fields only when it is first read, so lessons merged by compress_timetable()
+    never compute it.
+    '''
+    __slots__ = ('start', 'kind', '_unique_id', 'subject_id', 'end', 'title', 'description', 'source_id', 'recurrence', 'subject_name')
 
-    subject_id: int = None
-    end: datetime = None
-    title: str = None
-    description: str = None
+    def __init__(self,
+            start: datetime,
+            kind: AssignmentType,
+            unique_id: str = None,
+            subject_id: int = None,
+            end: datetime = None,
+            title: str = None,
+            description: str = None,
+            source_id: str = None, # ID of the record on Mastercom
+            recurrence: list = None, # RRULE and EXDATE lines of recurring assignments
+            subject_name: str = None, # Resolved by MastercomAPI while parsing
+        ) -> None:
+        self.start = start
+        self.kind = kind
+        self._unique_id = unique_id
+        self.subject_id = subject_id
+        self.end = end
+        self.title = title
+        self.description = description
+        self.source_id = source_id
+        self.recurrence = recurrence
+        self.subject_name = subject_name
 
-    def __post_init__(self) -> None:
+    @property
+    def unique_id(self) -> str:
+        if self._unique_id is None:
+            self._unique_id = sha256(self._identity_seed().encode('utf8')).hexdigest()
+        return self._unique_id
+
+    @unique_id.setter
+    def unique_id(self, unique_id: str):
+        self._unique_id = unique_id
+
+    def _fields(self) -> tuple:
+        return (self.start, self.kind, self.unique_id, self.subject_id, self.end, self.title,
+            self.description, self.source_id, self.recurrence, self.subject_name)
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None # Mutable, so not hashable
+
+    def __repr__(self) -> str:
+        names = ['start', 'kind', 'unique_id', 'subject_id', 'end', 'title', 'description', 'source_id', 'recurrence', 'subject_name']
+        return 'Assignment(' + ', '.join(f'{name}={value!r}' for name, value in zip(names, self._fields())) + ')'
+
+    def _identity_seed(self) -> str:
+        if self.source_id is not None:
+            # Record IDs are only unique within the same feed
+            return ':'.join(str(i) for i in [self.kind.name, self.source_id, self.subject_id])
+        else:
+            # Content fingerprint, for records without an ID
+            return ':'.join(str(i) for i in [self.kind.name, self.start.isoformat(), self.subject_id, self.title, self.description])
+
+    @property
+    def legacy_id(self) -> str:
+        '''The unique_id used by older versions, shared by every assignment of the same kind on the same day'''
         seed = self.start.isoformat() + self.kind.name
-        self.unique_id = sha256(seed.encode('utf8')).hexdigest()
+        return sha256(seed.encode('utf8')).hexdigest()
 
     @property
     def subject(self) -> str:
+        if self.subject_name is not None:
+            return self.subject_name
         return SUBJECT_NAME_MAP.get(self.subject_id, '')
 
 
@@ -91,6 +216,9 @@ class Assignment:
 class MastercomAPI:
     token: str
     url: str
+    school_year: int
+    client: CachedHTTPClient
+    subject_cache: SubjectCache
 
     @classmethod
     def from_user_pass(cls,
@@ -100,9 +228,27 @@ class MastercomAPI:
             school_id: str,
             student_id: str,
             school_year: int = None,
+            client: CachedHTTPClient = None,
+            subject_cache: SubjectCache = None,
         ) -> 'MastercomAPI':
         token = get_token(username, password, mastercom_id, school_id)
-        return MastercomAPI(token, mastercom_id, school_id, student_id, school_year)
+        return MastercomAPI(token, mastercom_id, school_id, student_id, school_year, client, subject_cache)
+
+    @classmethod
+    def from_token_file(cls, token_path: Path, client: CachedHTTPClient = None) -> 'MastercomAPI':
+        '''Creates an object from the token file written by setup.py, its token is renewed together with the file'''
+        credential = mastercom_credential(token_path)
+        token_dict = credential.token_dict
+
+        api = MastercomAPI(
+            token=token_dict['token'],
+            mastercom_id=token_dict['mastercom_id'],
+            school_id=token_dict['school_id'],
+            student_id=token_dict['student_id'],
+            client=client
+        )
+        credential.attach(api)
+        return api
 
     def __init__(self,
             token: str,
@@ -110,62 +256,154 @@ class MastercomAPI:
             school_id: str,
             student_id: str,
             school_year: int = None,
+            client: CachedHTTPClient = None,
+            subject_cache: SubjectCache = None,
         ) -> None:
 
         if school_year == None:
             school_year = (datetime.now() - timedelta(days=365/2)).year
 
+        self.school_year = school_year
         self.url = BASE_URL.format(mastercom_id, 3) + f'/scuole/{school_id}/studenti/{student_id}/{school_year}_{school_year + 1}'
         self.token = token
-
-    def request(self, 
-            request_type: AssignmentType, 
-            start: datetime = None, 
-            end: datetime = None, 
-            params: dict = {}
-        ) -> list:
+        self.client = client if client is not None else CachedHTTPClient()
+        self.subject_cache = subject_cache if subject_cache is not None else get_subject_cache()
+
+    def iter_request(self,
+            request_type: AssignmentType,
+            start: datetime = None,
+            end: datetime = None,
+            params: dict = None
+        ):
+        '''Yields the raw items of the response while it is being downloaded'''
         headers = {'Authorization': f'JWT {self.token}'}
 
+        params = dict(params or {})
         params.update({
             'data_inizio': start.date().isoformat() if start != None else None,
             'data_fine': end.date().isoformat() if end != None else None})
 
-        response = get(f'{self.url}/{REQUEST_MAP[request_type]}', headers=headers, params=params)
-
-        if response.status_code != 200:
-            raise ConnectionError(f'Request failed with status code {response.status_code}')
-
-        response_list = loads(response.text)
-        response_list = [{k: (unescape(v) if type(v) == str else v) for k, v in d.items()} for d in response_list]
+        chunks = self.client.stream(f'{self.url}/{REQUEST_MAP[request_type]}', headers=headers, params=params)
+        items = 0
+
+        try:
+            for item in iter_json_array(_measured(chunks, request_type)):
+                items += 1
+                yield item
+        except ValueError as e: # A truncated response is a failed request
+            raise ConnectionError(f'Invalid response: {e}') from e
+        finally:
+            metrics.count('mastercom_items', items, type=request_type.value)
+
+    def request(self,
+            request_type: AssignmentType,
+            start: datetime = None,
+            end: datetime = None,
+            params: dict = None
+        ) -> list:
+        return [{k: _unescape(v) for k, v in d.items()}
+            for d in self.iter_request(request_type, start, end, params)]
 
-        return response_list
+    def fetch_subjects(self) -> list:
+        '''Requests the subjects of the student and their teachers, use subjects() to get them from the cache'''
+        headers = {'Authorization': f'JWT {self.token}'}
+        try:
+            items = loads(self.client.get(f'{self.url}/{SUBJECTS_REQUEST}', headers=headers))
+            return [_subject_from_item(i) for i in items]
+        except (ValueError, TypeError, KeyError) as e: # Not the expected list of subjects
+            raise ConnectionError(f'Invalid response: {e}') from e
+
+    def subjects(self) -> dict:
+        '''Returns {subject ID: Subject}, requested at most once per school year and TTL of the cache'''
+        return self.subject_cache.get(self.url, self.fetch_subjects)
+
+    def invalidate_subjects(self):
+        self.subject_cache.invalidate(self.url)
+
+    def subject_names(self) -> dict:
+        '''Returns {subject ID: name}, with SUBJECT_NAME_MAP for the subjects the registro does not list'''
+        names = dict(SUBJECT_NAME_MAP)
+        names.update((k, v.name) for k, v in self.subjects().items())
+        return names
+
+    def iter_homework(self, start: datetime = None, end: datetime = None):
+        subject_names = self.subject_names() # Resolved once for the whole response
+
+        for i in self.iter_request(AssignmentType.HOMEWORK, start, end):
+            subject_id = int(i['id_materia'] or 0)
+            yield Assignment(
+                start = datetime.fromisoformat(i['data'][:19]),
+                kind = AssignmentType.HOMEWORK,
+                subject_id = subject_id,
+                description = _unescape(i['titolo']),
+                source_id = i.get('id'),
+                subject_name = subject_names.get(subject_id),
+            )
+
+    def iter_tests(self, start: datetime = None, end: datetime = None):
+        for i in self.iter_request(AssignmentType.TEST, start, end):
+            yield Assignment(
+                start = datetime.fromisoformat(i['data'][:19]),
+                kind = AssignmentType.TEST,
+                title = _unescape(i['sottotitolo']),
+                description = _unescape(i['titolo']),
+                source_id = i.get('id'),
+            )
 
     def homework(self, start: datetime = None, end: datetime = None) -> list:
-        raw_homework = self.request(AssignmentType.HOMEWORK, start, end)
-
-        return [Assignment(
-            start = datetime.fromisoformat(i['data'][:19]),
-            kind = AssignmentType.HOMEWORK,
-            subject_id = int(i['id_materia'] or 0),
-            description = i['titolo'],
-        ) for i in raw_homework]
+        return list(self.iter_homework(start, end))
 
     def tests(self, start: datetime = None, end: datetime = None) -> list:
-        raw_tests = self.request(AssignmentType.TEST, start, end)
-
-        return [Assignment(
-            start = datetime.fromisoformat(i['data'][:19]),
-            kind = AssignmentType.TEST,
-            title = i['sottotitolo'],
-            description = i['titolo'],
-        ) for i in raw_tests]
+        return list(self.iter_tests(start, end))
 
     def timetable(self, start: datetime, interval: timedelta = timedelta(days=6)) -> list:
         raw_timetable = self.request(AssignmentType.TIMETABLE, start, start + interval)
+        subject_names = self.subject_names()
 
         return [Assignment(
             start = datetime.fromisoformat(i['data_ora_inizio']),
             end = datetime.fromisoformat(i['data_ora_fine']),
             kind = AssignmentType.TIMETABLE,
             subject_id = int(i['id_materia'] or 0),
-        ) for i in raw_timetable]
\ No newline at end of file
+            subject_name = subject_names.get(int(i['id_materia'] or 0)),
+        ) for i in raw_timetable]
+
+    def school_year_bounds(self) -> tuple:
+        '''Returns the first and the last day of the school year'''
+        return datetime(self.school_year, 9, 1), datetime(self.school_year + 1, 8, 31)
+
+    def iter_assignments(self, kind: AssignmentType, start: datetime = None, end: datetime = None):
+        '''Like assignments(), but homework and tests are yielded while the response is being parsed'''
+        if kind == AssignmentType.TEST:
+            return self.iter_tests(start, end)
+        elif kind == AssignmentType.HOMEWORK:
+            return self.iter_homework(start, end)
+        return iter(self.assignments(kind, start, end))
+
+    def assignments(self, kind: AssignmentType, start: datetime = None, end: datetime = None) -> list:
+        '''Returns the assignments of the given kind, the timetable of the whole school year if there is no start'''
+        if kind == AssignmentType.TEST:
+            return self.tests(start, end)
+        elif kind == AssignmentType.HOMEWORK:
+            return self.homework(start, end)
+        elif kind == AssignmentType.TIMETABLE:
+            if start is None:
+                start, end = self.school_year_bounds()
+            return self.timetable(start) if end is None else self.timetable(start, end - start)
+
+    def backfill(self, kind: AssignmentType, windows: list, max_workers: int = 4):
+        '''
+        Fetches the (start, end) windows concurrently, yields (window, assignments) as soon as each one arrives
+
+        Assignments already yielded for another window are left out.
+        '''
+        seen_ids = set()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.assignments, kind, start, end): (start, end) for start, end in windows}
+
+            for future in as_completed(futures):
+                assignments = [i for i in future.result() if i.unique_id not in seen_ids]
+                seen_ids.update(i.unique_id for i in assignments)
+
+                yield futures[future], assignments
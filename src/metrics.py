@@ -0,0 +1,164 @@
+from dataclasses import dataclass
+from functools import wraps
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter, time
+from pathlib import Path
+from json import dumps
+
+from .atomic_file import atomic_write
+
+
+# Upper bounds of the latency buckets, in seconds, from mapping a single assignment to a slow request
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+@dataclass
+class Histogram:
+    buckets: tuple = LATENCY_BUCKETS
+    counts: list = None # Observations in each bucket, the last one is +Inf
+    count: int = 0
+    sum: float = 0.0
+
+    def __post_init__(self) -> None:
+        if self.counts is None:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list:
+        '''Returns (upper bound, observations up to it) for every bucket, as Prometheus expects'''
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class _Timer:
+    '''Observes the duration of a block, or of every call of a function when used as a decorator'''
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: dict) -> None:
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = perf_counter() - self._start
+        outcome = 'ok' if exc_type is None else 'error'
+        self._metrics.observe(f'{self._name}_seconds', elapsed, **self._labels)
+        self._metrics.count(f'{self._name}_total', outcome=outcome, **self._labels)
+        return False
+
+    def __call__(self, function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            # A new timer for every call, as calls may overlap in different threads
+            with _Timer(self._metrics, self._name, self._labels):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+
+class Metrics:
+    '''
+    Thread safe counters and latency histograms, identified by a name and labels
+
+    They are exported as JSON lines, to keep a history of the runs, or in the Prometheus text format.
+    '''
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def timed(self, name: str, **labels) -> _Timer:
+        '''
+        Records the latency in the <name>_seconds histogram and the calls in <name>_total by outcome
+
+        Usable both as "with metrics.timed(...):" and as "@metrics.timed(...)".
+        '''
+        return _Timer(self, name, labels)
+
+    def json_lines(self) -> str:
+        timestamp = time()
+        lines = []
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append({'time': timestamp, 'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value})
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda i: i[0]):
+                lines.append({'time': timestamp, 'type': 'histogram', 'name': name, 'labels': dict(labels),
+                    'count': histogram.count, 'sum': histogram.sum,
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative()}})
+
+        return ''.join(dumps(i) + '\n' for i in lines)
+
+    def prometheus(self) -> str:
+        lines = []
+
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (series_name, labels), value in sorted(self.counters.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{_prometheus_labels(labels)} {value}')
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (series_name, labels), histogram in sorted(self.histograms.items(), key=lambda i: i[0]):
+                    if series_name != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{_prometheus_labels(labels + (("le", le),))} {count}')
+                    lines.append(f'{name}_sum{_prometheus_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_prometheus_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Path):
+        '''Writes the Prometheus text format to .prom files, otherwise appends JSON lines'''
+        if path.suffix == '.prom':
+            # Replaced atomically, as collectors may read it at any time
+            with atomic_write(path) as file:
+                file.write(self.prometheus())
+        else:
+            with open(path, 'a') as file:
+                file.write(self.json_lines())
+
+
+def _prometheus_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+metrics = Metrics() # Shared by the whole process
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from datetime import date
+from json import loads, dumps
+from uuid import uuid4
+import sqlite3
+
+from .reconciler import AddResult, PlannedAction
+
+
+MAX_ATTEMPTS = 5 # A mutation that fails this many times is dropped
+
+
+@dataclass
+class Mutation:
+    '''A pending write to the calendar, at most one for each assignment'''
+    result: AddResult
+    unique_id: str
+    event_id: str # For additions, the ID the new event will have
+    body: dict = None
+    summary: str = ''
+    kind: str = None
+    start: date = None
+    attempts: int = 0
+    seq: int = None # Position in the queue
+
+    @classmethod
+    def from_action(cls, action: PlannedAction) -> 'Mutation':
+        if action.result == AddResult.ADD:
+            # Chosen here so that a retried insert that had already succeeded fails with 409 instead of duplicating the event
+            event_id = uuid4().hex
+        else:
+            event_id = action.event.id
+
+        return cls(
+            action.result,
+            action.unique_id,
+            event_id,
+            action.body,
+            action.summary,
+            action.assignment.kind.value if action.assignment is not None else None,
+            action.assignment.start.date() if action.assignment is not None else None)
+
+
+class Outbox:
+    '''
+    A write-ahead queue of calendar mutations, stored in the same database as the SQLiteEventStore
+
+    Mutations for the same assignment are coalesced: a newer body replaces the pending one, an addition
+    followed by a removal cancels out. Whatever is not sent in a run is sent in the next one.
+    '''
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self._connection = connection
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def get(self, unique_id: str) -> 'Mutation | None':
+        row = self._connection.execute(
+            'SELECT result, unique_id, event_id, body, summary, kind, start, attempts, seq FROM outbox WHERE unique_id = ?',
+            (unique_id,)).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    def pending(self, limit: int = -1, after_seq: int = 0) -> list:
+        '''Returns the oldest mutations first, after_seq allows to go through the queue once'''
+        rows = self._connection.execute(
+            'SELECT result, unique_id, event_id, body, summary, kind, start, attempts, seq FROM outbox '
+            'WHERE seq > ? ORDER BY seq LIMIT ?',
+            (after_seq, limit)).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def enqueue(self, mutation: Mutation):
+        pending = self.get(mutation.unique_id)
+
+        if pending is None:
+            self._insert(mutation)
+        elif pending.result == AddResult.ADD and mutation.result == AddResult.REMOVE:
+            if pending.attempts == 0:
+                self.cancel(mutation.unique_id)
+            else: # The event may have been added by a failed attempt
+                self._replace(pending, AddResult.REMOVE, mutation)
+        elif pending.result == AddResult.ADD:
+            self._replace(pending, AddResult.ADD, mutation)
+        elif mutation.result == AddResult.ADD:
+            # The event of the pending patch or removal is no longer in the calendar, it is added again with a new ID
+            self.cancel(mutation.unique_id)
+            self._insert(mutation)
+        else:
+            self._replace(pending, mutation.result, mutation)
+
+    def cancel(self, unique_id: str):
+        self._connection.execute('DELETE FROM outbox WHERE unique_id = ?', (unique_id,))
+
+    def cancel_event(self, event_id: str):
+        '''Drops the mutations of an event removed by other means, so that they are not replayed'''
+        self._connection.execute('DELETE FROM outbox WHERE event_id = ?', (event_id,))
+
+    def done(self, mutation: Mutation):
+        self.cancel(mutation.unique_id)
+
+    def failed(self, mutation: Mutation) -> bool:
+        '''Records a failed attempt, returns False if the mutation has been dropped'''
+        if mutation.attempts + 1 >= MAX_ATTEMPTS:
+            self.cancel(mutation.unique_id)
+            return False
+
+        self._connection.execute(
+            'UPDATE outbox SET attempts = attempts + 1 WHERE unique_id = ?', (mutation.unique_id,))
+        return True
+
+    def _insert(self, mutation: Mutation):
+        self._connection.execute(
+            'INSERT INTO outbox (result, unique_id, event_id, body, summary, kind, start, attempts) VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+            (mutation.result.value, mutation.unique_id, mutation.event_id,
+                dumps(mutation.body) if mutation.body is not None else None, mutation.summary,
+                mutation.kind, mutation.start.isoformat() if mutation.start is not None else None))
+
+    def _replace(self, pending: Mutation, result: AddResult, mutation: Mutation):
+        '''Changes a pending mutation to the given result and the body of mutation, keeping its position and event ID'''
+        self._connection.execute(
+            'UPDATE outbox SET result = ?, body = ?, summary = ? WHERE unique_id = ?',
+            (result.value, dumps(mutation.body) if mutation.body is not None else None,
+                mutation.summary or pending.summary, pending.unique_id))
+
+    def _from_row(self, row: tuple) -> Mutation:
+        result, unique_id, event_id, body, summary, kind, start, attempts, seq = row
+        return Mutation(
+            AddResult(result),
+            unique_id,
+            event_id,
+            loads(body) if body is not None else None,
+            summary,
+            kind,
+            date.fromisoformat(start) if start is not None else None,
+            attempts,
+            seq)
@@ -0,0 +1,61 @@
+from queue import Queue, Full
+from threading import Thread, Event
+
+
+_END = object()
+
+
+class Prefetch:
+    '''
+    Runs an iterator in a background thread, keeping at most maxsize of its items ahead of the consumer
+
+    Errors raised by the iterator are raised again while iterating. Closing it stops the
+    background thread at the next item, for when the consumer does not read all of them.
+    '''
+    def __init__(self, iterator_function, maxsize: int = 256, ready: Queue = None):
+        self._queue = Queue(maxsize)
+        self._closed = Event()
+        self._ready = ready
+        self._thread = Thread(target=self._run, args=(iterator_function,), daemon=True)
+        self._thread.start()
+
+    def _run(self, iterator_function):
+        signaled = False
+        try:
+            for item in iterator_function():
+                if not signaled:
+                    self._signal_ready()
+                    signaled = True
+                if not self._put((item, None)):
+                    return
+            self._put((_END, None))
+        except BaseException as e:
+            self._put((_END, e))
+        finally:
+            if not signaled:
+                self._signal_ready()
+
+    def _signal_ready(self):
+        if self._ready is not None:
+            self._ready.put(self)
+
+    def _put(self, entry) -> bool:
+        while not self._closed.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            item, error = self._queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+
+    def close(self):
+        self._closed.set()
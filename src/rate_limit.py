@@ -0,0 +1,88 @@
+from threading import Lock
+from random import uniform
+from time import monotonic, sleep
+
+from .google_api import http_error
+from .metrics import metrics
+
+
+DEFAULT_QPS = 5 # Requests per second allowed for each user
+QUOTA_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded')
+
+
+class TokenBucket:
+    '''A thread safe token bucket, acquire() blocks until enough tokens are available'''
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last = monotonic()
+        self._lock = Lock()
+
+    def acquire(self, tokens: float = 1):
+        # Requests bigger than the bucket wait for a full bucket, then leave it in debt
+        tokens_needed = min(tokens, self.capacity)
+
+        with self._lock: # Holding the lock while sleeping keeps waiting threads in order
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            if self._tokens < tokens_needed:
+                sleep((tokens_needed - self._tokens) / self.rate)
+                self._tokens = tokens_needed
+                self._last = monotonic()
+
+            self._tokens -= tokens
+
+
+_limiters = {}
+_limiters_lock = Lock()
+
+
+def get_limiter(key: str = 'default', qps: float = DEFAULT_QPS) -> TokenBucket:
+    '''Returns the limiter shared by every thread using the key, that should identify a Google user'''
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(qps)
+        return _limiters[key]
+
+
+def is_quota_error(error: Exception) -> bool:
+    if not isinstance(error, http_error()):
+        return False
+
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        content = error.content.decode('utf8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+        return any(reason in content for reason in QUOTA_REASONS)
+    return False
+
+
+def backoff_delay(attempt: int, base: float = 1, maximum: float = 32) -> float:
+    '''Exponential backoff with full jitter'''
+    return uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def execute(request, limiter: TokenBucket = None, max_retries: int = 5):
+    '''Executes a Google API request within the limiter, retrying with backoff when over quota'''
+    limiter = limiter if limiter is not None else get_limiter()
+    method = getattr(request, 'methodId', None) or 'batch' # Batch requests have no method
+
+    for attempt in range(max_retries + 1):
+        wait_start = monotonic()
+        limiter.acquire()
+        metrics.observe('google_limiter_wait_seconds', monotonic() - wait_start)
+
+        metrics.count('google_request_bytes', len(getattr(request, 'body', None) or ''), method=method)
+        try:
+            with metrics.timed('google_request', method=method):
+                return request.execute()
+        except http_error() as e:
+            if not is_quota_error(e) or attempt == max_retries:
+                raise
+
+        metrics.count('google_retries_total', method=method)
+        sleep(backoff_delay(attempt))
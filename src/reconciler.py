@@ -0,0 +1,59 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from math import ceil
+
+from .google_calendar import Event
+from .mastercom import Assignment
+
+
+class AddResult(Enum):
+    ADD = 'add'
+    SKIP = 'skip'
+    PATCH = 'patch'
+    REMOVE = 'remove'
+    ERROR = 'error'
+
+
+WRITES = (AddResult.ADD, AddResult.PATCH, AddResult.REMOVE)
+
+
+@dataclass
+class PlannedAction:
+    '''A single change to the calendar, result is the AddResult it will produce'''
+    result: AddResult
+    unique_id: str
+    assignment: Assignment = None
+    body: dict = None
+    event: Event = None # The existing event, None for additions
+
+    @property
+    def summary(self) -> str:
+        if self.body is not None:
+            return self.body['summary']
+        return (self.event.summary if self.event is not None else None) or ''
+
+
+@dataclass
+class Plan:
+    '''The full difference between the assignments on Mastercom and the events in the calendar'''
+    actions: list = field(default_factory=list)
+    batch_size: int = 0
+
+    def actions_of(self, result: AddResult) -> list:
+        return [i for i in self.actions if i.result == result]
+
+    def writes(self) -> int:
+        return sum(1 for i in self.actions if i.result in WRITES)
+
+    def api_calls(self) -> int:
+        '''HTTP requests needed to apply the plan'''
+        return ceil(self.writes() / self.batch_size) if self.batch_size else self.writes()
+
+    def print(self):
+        for result, title in [(AddResult.ADD, 'Da aggiungere'), (AddResult.PATCH, 'Da aggiornare'), (AddResult.REMOVE, 'Da rimuovere')]:
+            actions = self.actions_of(result)
+            print(f'{title} ({len(actions)}):')
+            print('\n'.join(f'  ⦁ {i.summary[:100]}' for i in actions))
+
+        print(f'Invariati ({len(self.actions_of(AddResult.SKIP))})')
+        print(f'Modifiche: {self.writes()}, richieste a Google Calendar: {self.api_calls()}\n')
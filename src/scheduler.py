@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field
+from datetime import datetime, date, time, timedelta
+from pathlib import Path
+from json import load
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+
+HOLIDAYS_PATH = Path('config/holidays.json')
+LOCK_PATH = Path('config/autocalendar.lock')
+
+
+def load_holidays(path: Path = HOLIDAYS_PATH) -> list:
+    '''Reads a list of {"start": "YYYY-MM-DD", "end": "YYYY-MM-DD"} periods, both ends included'''
+    if not path.exists():
+        return []
+
+    with open(path, 'r') as file:
+        return [(date.fromisoformat(i['start']), date.fromisoformat(i['end'])) for i in load(file)]
+
+
+@dataclass
+class PollingScheduler:
+    '''Decides how long to wait before the next sync, polling more often when new assignments are likely'''
+    school_hours_interval: timedelta = timedelta(minutes=20)
+    upcoming_test_interval: timedelta = timedelta(minutes=10)
+    day_interval: timedelta = timedelta(hours=1)
+    night_interval: timedelta = timedelta(hours=4)
+    weekend_interval: timedelta = timedelta(hours=3)
+    holiday_interval: timedelta = timedelta(hours=8)
+
+    school_days: tuple = (0, 1, 2, 3, 4, 5) # Monday to Saturday
+    school_hours: tuple = (time(7, 30), time(14, 30))
+    night_hours: tuple = (time(22, 0), time(6, 30))
+    upcoming_test_window: timedelta = timedelta(days=2)
+
+    holidays: list = field(default_factory=list)
+    upcoming_tests: list = field(default_factory=list) # Start of the next tests, updated by the caller
+
+    def is_holiday(self, day: date) -> bool:
+        return any(start <= day <= end for start, end in self.holidays)
+
+    def is_school_day(self, day: date) -> bool:
+        return day.weekday() in self.school_days and not self.is_holiday(day)
+
+    def interval(self, now: datetime) -> timedelta:
+        '''Returns the time to wait after a sync that ended at now'''
+        night_start, night_end = self.night_hours
+        if now.time() >= night_start or now.time() < night_end:
+            return self.night_interval
+
+        if self.is_holiday(now.date()):
+            return self.holiday_interval
+
+        if any(now <= test <= now + self.upcoming_test_window for test in self.upcoming_tests):
+            return self.upcoming_test_interval
+
+        if not self.is_school_day(now.date()):
+            return self.weekend_interval
+
+        school_start, school_end = self.school_hours
+        if school_start <= now.time() < school_end:
+            return self.school_hours_interval
+
+        return self.day_interval
+
+    def next_run(self, now: datetime) -> datetime:
+        '''Returns when the next sync should start, never sleeping past the start of a school day'''
+        next_run = now + self.interval(now)
+        school_start = self._next_school_start(now)
+
+        if school_start is not None and now < school_start < next_run:
+            return school_start
+        return next_run
+
+    def _next_school_start(self, now: datetime) -> 'datetime | None':
+        for days in range(8):
+            day = now.date() + timedelta(days=days)
+            start = datetime.combine(day, self.school_hours[0])
+
+            if start > now and self.is_school_day(day):
+                return start
+
+        return None
+
+
+class RunLock:
+    '''A lock file that prevents two syncs from running at the same time, even in different processes'''
+
+    def __init__(self, path: Path = LOCK_PATH) -> None:
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        '''Returns False without waiting if another run holds the lock'''
+        file = open(self.path, 'a+')
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            return False
+
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> 'RunLock':
+        if not self.acquire():
+            raise RuntimeError(f'Another run is holding "{self.path}"')
+        return self
+
+    def __exit__(self, *args):
+        self.release()
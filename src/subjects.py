@@ -0,0 +1,125 @@
+from dataclasses import dataclass, field, asdict
+from datetime import timedelta
+from threading import Lock
+from pathlib import Path
+from json import load, dump
+from time import time
+
+from .metrics import metrics
+from .atomic_file import atomic_write
+
+
+SUBJECTS_PATH = Path('config/cache/subjects.json')
+SUBJECTS_TTL = timedelta(days=30) # Teachers may change during the year, subjects almost never do
+FAILED_FETCH_TTL = timedelta(hours=6) # A registro without the subjects endpoint is not asked at every run
+
+
+@dataclass
+class Subject:
+    id: int
+    name: str
+    teachers: list = field(default_factory=list)
+
+
+@dataclass
+class _Entry:
+    fetched_at: float
+    subjects: dict # Subject ID: Subject
+    failed: bool = False
+
+
+class SubjectCache:
+    '''
+    The subjects and teachers of every student and school year, saved on disk
+
+    An entry is fetched once and then reused by every process for ttl, or until invalidate().
+    Concurrent requests for the same key wait for a single fetch. If a fetch fails for any reason the
+    stale entry, or an empty one, is used, so names fall back to SUBJECT_NAME_MAP instead of failing the sync.
+    '''
+
+    def __init__(self, path: Path = SUBJECTS_PATH, ttl: timedelta = SUBJECTS_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._entries = {} # Key: _Entry
+        self._lock = Lock()
+        self._fetch_locks = {}
+
+        if path.exists():
+            with open(path, 'r') as file:
+                for key, entry in load(file).items():
+                    subjects = {int(k): Subject(**v) for k, v in entry['subjects'].items()}
+                    self._entries[key] = _Entry(entry['fetched_at'], subjects, entry.get('failed', False))
+
+    def get(self, key: str, fetch_function) -> dict:
+        '''Returns {subject ID: Subject} for the key, calling fetch_function() only if the entry has expired'''
+        entry = self._fresh_entry(key)
+        if entry is not None:
+            metrics.count('subject_cache_total', result='hit')
+            return entry.subjects
+
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, Lock())
+
+        with fetch_lock:
+            entry = self._fresh_entry(key) # Fetched by another thread while we waited
+            if entry is not None:
+                metrics.count('subject_cache_total', result='hit')
+                return entry.subjects
+
+            try:
+                entry = _Entry(time(), {i.id: i for i in fetch_function()})
+                metrics.count('subject_cache_total', result='miss')
+            except Exception: # The endpoint is not documented, any failure falls back to the names in the code
+                metrics.count('subject_cache_total', result='error')
+                with self._lock:
+                    stale = self._entries.get(key)
+                entry = _Entry(time(), stale.subjects if stale is not None else {}, failed=True)
+
+            with self._lock:
+                self._entries[key] = entry
+                self._save()
+
+            return entry.subjects
+
+    def invalidate(self, key: str = None):
+        '''Makes the next get() fetch again the key, or every key'''
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._save()
+
+    def _fresh_entry(self, key: str) -> '_Entry | None':
+        with self._lock:
+            entry = self._entries.get(key)
+
+        ttl = FAILED_FETCH_TTL if entry is not None and entry.failed else self.ttl
+        if entry is None or time() - entry.fetched_at >= ttl.total_seconds():
+            return None
+        return entry
+
+    def _save(self):
+        '''Replaces the file at once, called with the lock held'''
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with atomic_write(self.path) as file:
+            dump({key: {
+                'fetched_at': entry.fetched_at,
+                'failed': entry.failed,
+                'subjects': {str(k): asdict(v) for k, v in entry.subjects.items()}}
+                for key, entry in self._entries.items()}, file)
+
+
+_caches = {}
+_caches_lock = Lock()
+
+
+def get_subject_cache(path: Path = SUBJECTS_PATH) -> SubjectCache:
+    '''Returns the cache shared by every MastercomAPI of the process using the file'''
+    key = str(Path(path).resolve())
+
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = SubjectCache(path)
+        return _caches[key]
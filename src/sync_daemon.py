@@ -0,0 +1,75 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from threading import Event
+import signal
+
+from .calendar_adder import CalendarAdder, AssignmentType
+from .scheduler import PollingScheduler, RunLock
+from .metrics import metrics
+from .credentials import CredentialManager
+
+
+@dataclass
+class SyncDaemon:
+    '''Keeps a CalendarAdder, with its clients, caches and mirror, in memory and syncs it on a schedule'''
+    calendar_adder: CalendarAdder
+    scheduler: PollingScheduler = field(default_factory=PollingScheduler)
+    lock: RunLock = field(default_factory=RunLock)
+    types: tuple = (AssignmentType.HOMEWORK, AssignmentType.TEST)
+    metrics_path: Path = None # Written after every run, the counters add up since the start
+    credentials: CredentialManager = None # Refreshed in the background while the daemon runs
+
+
+    _stop: Event = field(default_factory=Event, init=False, repr=False)
+
+    def stop(self, *args):
+        '''Makes run() return after the current sync, can be used as a signal handler'''
+        self._stop.set()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        if self.credentials is not None:
+            self.credentials.start()
+
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+
+                next_run = self.scheduler.next_run(datetime.now())
+                print(f'[i] Prossima sincronizzazione: {next_run.strftime("%d-%m-%Y %H:%M")}')
+                self._stop.wait(max((next_run - datetime.now()).total_seconds(), 0))
+        finally:
+            if self.credentials is not None:
+                self.credentials.stop()
+
+        print('[i] Chiusura')
+
+    def run_once(self):
+        if not self.lock.acquire():
+            print('[!] Un\'altra sincronizzazione è in corso, turno saltato')
+            return
+
+        try:
+            # The background refresh may be waiting to retry, a token expired meanwhile would fail the whole run
+            if self.credentials is not None:
+                for e in self.credentials.ensure_fresh():
+                    print(f'[!] Rinnovo delle credenziali fallito: {e}')
+
+            self.calendar_adder.reset_tally()
+            self.calendar_adder.sync(self.types)
+
+            # Served by the HTTP cache, as sync() has just requested the same tests
+            tests = self.calendar_adder.mastercom.tests(datetime.now())
+            self.scheduler.upcoming_tests = [i.start for i in tests]
+
+            self.calendar_adder.print_tally(compact=True)
+        except Exception as e: # A failed sync, whatever the cause, is retried at the next run
+            print(f'[!] Sincronizzazione fallita: {type(e).__name__}: {e}')
+        finally:
+            self.lock.release()
+
+        if self.metrics_path is not None:
+            metrics.write(self.metrics_path)
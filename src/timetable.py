@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from .mastercom import Assignment, AssignmentType
+
+
+TIMEZONE = 'Europe/Rome' # Recurring events need an explicit time zone
+MAX_OVERRIDE_WEEKS = 2 # Longer changes of subject are considered a new timetable
+
+
+def compress_timetable(lessons: list) -> list:
+    '''
+    Turns the lessons of a timetable into weekly recurring assignments
+
+    Lessons are grouped by weekday and time. In every group each run of lessons of the same
+    subject becomes one assignment with a weekly RRULE, and the weeks without that lesson become
+    EXDATEs. Substitutions, runs of at most MAX_OVERRIDE_WEEKS between two runs of the same
+    subject, are returned as single lessons on top of the series they interrupt.
+    '''
+    slots = {}
+    for lesson in sorted(lessons, key=lambda i: i.start):
+        slots.setdefault((lesson.start.weekday(), lesson.start.time(), lesson.end.time()), []).append(lesson)
+
+    assignments = []
+    for slot_lessons in slots.values():
+        runs, overrides = _subject_runs(slot_lessons)
+
+        assignments += overrides
+        for run in runs:
+            assignments += [_recurring(run)] if len(run) > 1 else run
+
+    return assignments
+
+
+def _subject_runs(lessons: list) -> tuple:
+    '''Splits the lessons of a slot in runs of the same subject, returns (runs, overrides)'''
+    runs = []
+    for lesson in lessons:
+        if runs and runs[-1][0].subject_id == lesson.subject_id:
+            runs[-1].append(lesson)
+        else:
+            runs.append([lesson])
+
+    merged_runs = []
+    overrides = []
+    for run in runs:
+        if len(merged_runs) >= 2 \
+                and merged_runs[-2][0].subject_id == run[0].subject_id \
+                and len(merged_runs[-1]) <= MAX_OVERRIDE_WEEKS:
+            overrides += merged_runs.pop()
+            merged_runs[-1] += run
+        else:
+            merged_runs.append(run)
+
+    return merged_runs, overrides
+
+
+def _recurring(run: list) -> Assignment:
+    first, last = run[0], run[-1]
+    dates = {i.start.date() for i in run}
+    weeks = (last.start.date() - first.start.date()).days // 7
+
+    exdates = [first.start + timedelta(weeks=i) for i in range(weeks + 1)
+        if (first.start + timedelta(weeks=i)).date() not in dates]
+
+    # UNTIL must be in UTC when the start has a time zone
+    recurrence = [f'RRULE:FREQ=WEEKLY;UNTIL={last.start.strftime("%Y%m%d")}T235959Z']
+    if exdates:
+        recurrence.append(f'EXDATE;TZID={TIMEZONE}:' + ','.join(i.strftime('%Y%m%dT%H%M%S') for i in exdates))
+
+    return Assignment(
+        start = first.start,
+        end = first.end,
+        kind = AssignmentType.TIMETABLE,
+        subject_id = first.subject_id,
+        recurrence = recurrence,
+        subject_name = first.subject_name)